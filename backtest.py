@@ -4,19 +4,104 @@ import pandas as pd
 import sys
 import math
 from abc import abstractmethod, ABCMeta
-
-import talib
+from logging import DEBUG, INFO, WARNING
+
+from indicators import INDICATORS, INCREMENTAL
+from metrics import annualised
+from orderbook import OrderBook
+from data import load
+from ledger import Ledger
+from timeframe import Timeframe
+from spec import compile_spec, spec_indicators, spec_lookback, RSI_SPEC, SMA_CROSSOVER_SPEC
+from profiler import Profiler
+import compiled
+import snapshot
+from fills import Fills, NAMES, LONG_BUY, LONG_SELL, SHORT_SELL, SHORT_BUY, STOP_SELL, STOP_BUY
 
 # =============================================================================
 
-DEBUG = False
+# Event Logging
+#
+# Backtests report events through an optional hook called as
+# log(level, event, fields), with logging levels: DEBUG for per-bar detail, INFO
+# for fills and OCO activity, WARNING for rejected orders and ruin. Call sites
+# check bt.log before building any fields, so a backtest without a hook
+# (the default) does no logging work at all.
+
+MESSAGES = {
+    "bar": "{index} Close: {close}\nHeld: {held}\nOwed: {owed}\nBalance: {balance}\nEquity: {equity}",
+    "indicator": "{name}: {value:.2f}",
+    "fill": "{type}",
+    "oco": "Added OCO order.",
+    "cancel": "{cancelled} cancelled due to OCO.",
+    "commission": "Not enough balance to include commission payment.",
+    "ruin": "No more equity remains.",
+}
+
+# Hook printing events as plain text
+def print_log(level, event, fields):
+    print(MESSAGES[event].format(**fields))
+
+# Hook forwarding events to a logging.Logger
+def logger_log(logger):
+    def log(level, event, fields):
+        logger.log(level, MESSAGES[event].format(**fields), extra={"event": event, "fields": fields})
+    return log
+
+COLUMNS = ("Open", "High", "Low", "Close", "Volume")
+
+# Tie-break rules for OCO legs that both fill within one bar (see Backtest.fill):
+# "first" tries order1 then order2, "open" the leg priced nearest the Open (the
+# price reaches it first), "worst"/"best" the leg with the worse/better price
+# for the position
+OCO_RULES = ("first", "open", "worst", "best")
+SELLS = (LONG_SELL, SHORT_SELL, STOP_SELL)
+
+# Carry the last non-NaN value forward, starting from initial
+def _ffill(values, initial=0.0):
+    valid = ~np.isnan(values)
+    index = np.maximum.accumulate(np.where(valid, np.arange(values.shape[0]), -1))
+    return np.where(index >= 0, values[np.maximum(index, 0)], initial)
 
 class Backtest:
-    def __init__(self, datapath, strategy, capital, long_max=1, short_max=1):
-        self.data = pd.read_csv(datapath)
+    def __init__(self, datapath, strategy, capital, long_max=1, short_max=1, params=None,
+        log=None, log_level=INFO, step=False, intrabar=False, oco="first", lots="fifo", profile=False):
+        # Timings per phase, True or a Profiler to enable (see profiler.py)
+        self.profiler = Profiler() if profile == True else (profile or None)
+        if self.profiler is not None:
+            self.profiler.enter("load")
+
+        # A CSV path (read through the binary cache), or a DataFrame or dict of
+        # column arrays already loaded and shared between runs
+        if isinstance(datapath, pd.DataFrame):
+            self._load({column: datapath[column].to_numpy() for column in datapath.columns})
+            self._data = datapath
+        elif isinstance(datapath, dict):
+            self._load(datapath)
+        else:
+            self._load(load(datapath))
+        if self.profiler is not None:
+            self.profiler.exit()
         self.index = 0
+        self.offset = 0 # Bar number of position 0 in the arrays (non-zero when streaming)
+        self.origin = 0 # Bar number of the first bar run (non-zero for a slice, see walkforward.py)
+        self.first_date = self.dates[0]
+        self.first_close = self.close[0]
         self.capital = capital
         self.strategy = strategy
+        self.params = {} if params is None else params # Strategy parameters
+
+        self.log = log # Event hook, None to disable
+        self.log_level = log_level
+        self.step = step # Wait for enter before each bar
+
+        # Resting orders fill inside the bar from its Open/High/Low rather than at the Close
+        self.intrabar = intrabar
+        if intrabar and (self.open is None or self.high is None or self.low is None):
+            raise ValueError("Intrabar fills need Open, High and Low columns")
+        if oco not in OCO_RULES:
+            raise ValueError("Unknown OCO rule {!r}, expected one of {}".format(oco, OCO_RULES))
+        self.oco = oco
 
         # Working
         self.quantity_held = 0
@@ -31,98 +116,555 @@ class Backtest:
         self.long_count = 0
         self.short_count = 0
 
-        self.trades = [] # Active trades
+        self.trades = OrderBook() # Active trades, indexed by trigger price
         self.entered_positions = 0
-        self.winning_positions = 0
+        self.ledger = Ledger(lots) # Open lots and closed trades, "fifo" or "average" cost
 
         # Statistics
         self.equity_peak = capital
-        self.history = [] # Trade history
+        self.history = Fills() # Trade history
         self.trade_duration = 0
         self.commission_total = 0
 
-        # For trades not explicitly linked, assume a trade of some position (short/long)
-        # is matches with the next opposite trade of the same position
-        # - store previous position size
-        self.previous_long = capital
-        self.previous_short = capital
+        # Equity, cash and net position after each bar, allocated by run()
+        self.equity_curve = None
+        self.cash_curve = None
+        self.position_curve = None
+
+        # Indicator arrays over the whole series, keyed by (name, params)
+        self.indicators = {}
+        self.signals = None # Signal arrays for the Signals strategy and run_vectorized
+        self.online = {} # Incremental indicators and their input columns, keyed by (name, params)
+        self.timeframes = {} # Higher-timeframe aggregates, keyed by rule
+        self.bar = Bar(self) # Current bar view for strategies
+
+    def _load(self, source):
+        self.source = source # Every column, by name
+        self.dates = source["Date"]
+        self.length = len(source["Close"])
+        self._data = None
+
+        # Contiguous float64 price columns, read by the per-bar hot path
+        self.columns = {}
+        for column in COLUMNS:
+            if column in source:
+                self.columns[column] = np.ascontiguousarray(source[column], dtype=np.float64)
+        self.open = self.columns.get("Open")
+        self.high = self.columns.get("High")
+        self.low = self.columns.get("Low")
+        self.close = self.columns["Close"]
+        self.volume = self.columns.get("Volume")
     
+    @property
+    def winning_positions(self): # Closed trades with a positive P&L
+        return self.ledger.wins
+
+    @property
+    def closed_positions(self): # Closed trades, several entries each when lots are averaged
+        return len(self.ledger.closed)
+
+    @property
+    def data(self): # DataFrame of every column, built on first use
+        if self._data is None:
+            self._data = pd.DataFrame(self.source)
+        return self._data
+
     def price(self):
-        return self.data["Close"].iloc[self.index]
+        return self.close[self.index]
+
+    # Strategies declare indicators as a tuple of (name, *params), or a function
+    # of the backtest returning one when they depend on bt.params, and higher
+    # timeframes as a tuple of rules, or a dict of rules to the indicators read
+    # on them, e.g. {"1D": (("SMA", 20),)}. A prepare(bt) function, if any, runs
+    # last to build whatever else the strategy reads per bar (e.g. Spec signals)
+    def precompute(self, strategy):
+        declared = getattr(strategy, "indicators", ())
+        if callable(declared):
+            declared = declared(self)
+        for name, *params in declared:
+            self.indicator(name, *params)
+        timeframes = getattr(strategy, "timeframes", ())
+        for rule in timeframes:
+            frame = self.timeframe(rule)
+            for name, *params in timeframes[rule] if isinstance(timeframes, dict) else ():
+                frame.indicator(name, *params)
+        prepare = getattr(strategy, "prepare", None)
+        if prepare is not None:
+            prepare(self)
+
+    def indicator(self, name, *params):
+        key = (name, params)
+        values = self.indicators.get(key)
+        if values is None:
+            function, columns = INDICATORS[name]
+            inputs = [self.columns[column] for column in columns]
+            values = function(*inputs, *params)
+            self.indicators[key] = values
+        return values
     
-    def run(self):
-        global DEBUG
-        if len(sys.argv) == 2:
-            if sys.argv[1] == "1":
-                DEBUG = True
-
-        while self.index < self.data.shape[0]:
-            if DEBUG == True:
-                input()
-
-            i = 0
-            while i < len(self.trades): # Execute queued trades
-                if self.trades[i].execute() == True:
-                    self.trades.remove(self.trades[i]) # Remove once executed
-                    i -= 1
-                i += 1
-            
-            # Strategies are executed immediately, otherwise are placed in the queue
-            # for execution in future periods
-            self.strategy(bt)
-
-            # Calculate current equity
-            self.equity = self.balance + (self.quantity_held * self.price()) - \
-                (self.quantity_owed * self.price())
-            if self.equity <= 0:
-                print("No more equity remains.")
-                return
-
-            if DEBUG == True:
-                print(f"{self.index} Close: " + str(self.price()))
-                print("Held: " + str(self.quantity_held))
-                print("Owed: " + str(self.quantity_owed))
-                print("Balance: " + str(self.balance))
-                print("Equity: " + str(self.equity))
-            
-            self.index += 1
-
-            # Statistics
-            if self.equity > self.equity_peak: # Peak Equity
-                self.equity_peak = self.equity
-            if self.long_count > 0 or self.short_count > 0: # Trade Duration
-                self.trade_duration += 1
-
-        # Liquidate all positions at the end
+    # Bars aggregated to a higher timeframe, every rule bars or a pandas frequency
+    # of the dates, read at the current bar without look-ahead (see timeframe.py):
+    # bt.timeframe("W").indicator("SMA", 10)[bt.index], bt.timeframe(5).column("High")[bt.index]
+    def timeframe(self, rule):
+        frame = self.timeframes.get(rule)
+        if frame is None:
+            frame = Timeframe(rule)
+            frame.extend(self.dates, self.columns, self.offset)
+            self.timeframes[rule] = frame
+        return frame
+
+    # Incremental indicator fed each completed bar, so at bar i it has seen the
+    # bars before i like the precomputed ones. Created on first use and caught
+    # up on the bars available.
+    def incremental(self, name, *params):
+        key = (name, params)
+        entry = self.online.get(key)
+        if entry is None:
+            kind, columns = INCREMENTAL[name]
+            entry = (kind(*params), columns)
+            for i in range(self.index):
+                entry[0].update(*[float(self.columns[column][i]) for column in columns])
+            self.online[key] = entry
+        return entry[0]
+
+    def emit(self, level, event, **fields):
+        if level >= self.log_level:
+            self.log(level, event, fields)
+
+    # With a checkpoint path, a snapshot is saved there every so many bars, to
+    # resume from with Backtest.restore(checkpoint, datapath).run(checkpoint)
+    def run(self, checkpoint=None, every=100000):
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start(ORDERS)
+        try:
+            # Compute declared indicators once before the first bar
+            if profiler is not None:
+                profiler.enter("precompute")
+            self.precompute(self.strategy)
+            if self.equity_curve is None: # Kept when resuming
+                self.allocate()
+            if profiler is not None:
+                profiler.exit()
+
+            while self.index < self.length:
+                if self.next() == False:
+                    return
+                if checkpoint is not None and self.index % every == 0:
+                    self.save(checkpoint)
+
+            if profiler is not None:
+                profiler.enter("liquidate")
+            self.liquidate()
+            if profiler is not None:
+                profiler.exit()
+        finally:
+            if profiler is not None:
+                profiler.stop()
+
+    # Preallocate the per-bar series, NaN past the last bar run
+    def allocate(self):
+        self.equity_curve = np.full(self.length, np.nan)
+        self.cash_curve = np.full(self.length, np.nan)
+        self.position_curve = np.full(self.length, np.nan)
+
+    def record(self):
+        if self.equity_curve is not None:
+            self.equity_curve[self.index] = self.equity
+            self.cash_curve[self.index] = self.balance
+            self.position_curve[self.index] = self.quantity_held - self.quantity_owed
+
+    # Per-bar series of the bars run, by date
+    def series(self):
+        end = self.index + 1
+        return pd.DataFrame({"Equity": self.equity_curve[:end], "Cash": self.cash_curve[:end],
+            "Position": self.position_curve[:end]}, index=pd.Index(self.dates[:end], name="Date"))
+
+    # State between bars as compact bytes, see snapshot.py
+    def snapshot(self):
+        return snapshot.dumps(self)
+
+    def save(self, path):
+        snapshot.save(self, path)
+
+    # Backtest continuing from a snapshot (bytes or a path) over the same data.
+    # The strategy is imported again unless given; options override the saved
+    # settings (long_max, short_max, params, intrabar, oco) or add hooks (log, ...)
+    @classmethod
+    def restore(cls, state, datapath, strategy=None, **options):
+        state = snapshot.read(state)
+        settings = snapshot.settings(state)
+        settings.update(options)
+        bt = cls(datapath, snapshot.strategy(state) if strategy is None else strategy, state["capital"],
+            **settings)
+        return snapshot.apply(bt, state)
+
+    # Copies of the current state that continue independently, sharing the
+    # loaded data and indicator cache, e.g. to branch what-if scenarios:
+    # bt.fork(params=dict(bt.params, atr_mult=2.0)).run()
+    def fork(self, strategy=None, **options):
+        settings = {"log": self.log, "log_level": self.log_level}
+        settings.update(options)
+        bt = self.restore(self.snapshot(), self.source, strategy or self.strategy, **settings)
+        bt.indicators = self.indicators # Keyed by name and parameters, so safe to share
+        return bt
+
+    # Process the bar at self.index, returning False once no equity remains
+    def next(self):
+        if self.step == True:
+            input()
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.queue.append(len(self.trades))
+
+        # Feed the previous bar to incremental indicators
+        if self.online and self.index > 0:
+            if profiler is not None:
+                profiler.enter("incremental")
+            for indicator, columns in self.online.values():
+                indicator.update(*[float(self.columns[column][self.index-1]) for column in columns])
+            if profiler is not None:
+                profiler.exit()
+
+        # Execute queued trades whose limits the price has reached
+        if profiler is not None:
+            profiler.enter("orders")
+        if self.intrabar:
+            self.trades.execute(self.low[self.index], self.high[self.index], self.fill)
+        else:
+            price = self.close[self.index]
+            self.trades.execute(price, price)
+        
+        # Strategies are executed immediately, otherwise are placed in the queue
+        # for execution in future periods
+        if profiler is not None:
+            profiler.exit()
+            profiler.enter("strategy:" + getattr(self.strategy, "__name__", type(self.strategy).__name__))
+        self.strategy(self)
+        if profiler is not None:
+            profiler.exit()
+            profiler.enter("equity")
+
+        # Calculate current equity
+        price = self.close[self.index]
+        self.equity = self.balance + (self.quantity_held * price) - \
+            (self.quantity_owed * price)
+        self.record()
+        if profiler is not None:
+            profiler.exit()
+        if self.equity <= 0:
+            if self.log is not None:
+                self.emit(WARNING, "ruin")
+            return False
+
+        if self.log is not None:
+            self.emit(DEBUG, "bar", index=self.offset + self.index, close=price, held=self.quantity_held,
+                owed=self.quantity_owed, balance=self.balance, equity=self.equity)
+        
+        self.index += 1
+
+        # Statistics
+        if self.equity > self.equity_peak: # Peak Equity
+            self.equity_peak = self.equity
+        if self.long_count > 0 or self.short_count > 0: # Trade Duration
+            self.trade_duration += 1
+        return True
+
+    # Price a resting order fills at within the current bar, None if not reached.
+    # Orders past their limit at the Open (a gap) fill at the Open, otherwise at
+    # the limit once the Low/High reaches it; orders without a limit at the Open
+    def intrabar_price(self, order):
+        i = self.index
+        open, limit = self.open[i], order.limit
+        if limit is None or limit != limit:
+            return open
+        if order.trigger == "below":
+            if open <= limit:
+                return open
+            return limit if self.low[i] <= limit else None
+        if open >= limit:
+            return open
+        return limit if self.high[i] >= limit else None
+
+    # Execute a resting order at its intrabar price
+    def fill(self, order):
+        if not hasattr(order, "order1"):
+            price = self.intrabar_price(order)
+            return price is not None and order.execute(price)
+
+        legs = [(leg, price) for leg in (order.order1, order.order2)
+            for price in (self.intrabar_price(leg),) if price is not None]
+        if len(legs) == 2 and self.oco != "first":
+            if self.oco == "open":
+                open = self.open[self.index]
+                legs.sort(key=lambda leg: abs(leg[1] - open))
+            elif (legs[0][0].code in SELLS) == (legs[1][0].code in SELLS): # Same side
+                sell = legs[0][0].code in SELLS
+                legs.sort(key=lambda leg: leg[1], reverse=sell == (self.oco == "best"))
+        return bool(legs) and order.execute(legs)
+
+    # Liquidate all positions at the end
+    def liquidate(self):
         self.index -= 1
-        LONGSELL(bt, bt.quantity_held, commission=0).execute() # First do long positions
-        SHORTBUY(bt, bt.quantity_owed, commission=0).execute()
+        LONGSELL(self, self.quantity_held, commission=0).execute() # First do long positions
+        SHORTBUY(self, self.quantity_owed, commission=0).execute()
 
         self.equity = self.balance + (self.quantity_held * self.price()) - \
                 (self.quantity_owed * self.price()) # Recalculate
+        self.record()
+
+    # Evaluate entry/exit signal arrays without the bar loop. Orders are market
+    # orders filled at the Close of the signal bar, one position per side, with
+    # exits placed before entries on the same bar (see Signals). The result
+    # matches run() with the Signals strategy, provided every order can be
+    # afforded when placed (run() would queue it instead). Intrabar fills are
+    # only simulated by run().
+    def run_vectorized(self, signals):
+        if self.intrabar:
+            raise ValueError("run_vectorized() fills at the Close, intrabar=True needs run()")
+        for key in ("allocation", "take_profit", "stop_loss"):
+            if key in signals:
+                raise ValueError("run_vectorized() does not support {!r}, use run_compiled()".format(key))
+        self.signals = signals
+        n = self.length
+        close = self.close
+        commission = signals.get("commission", 0)
+        size = np.broadcast_to(np.asarray(signals.get("size", 1), dtype=np.float64), (n,))
+        none = np.zeros(n, dtype=bool)
+
+        # Position state per side: an entry opens (after any exit on the same bar),
+        # an exit closes, otherwise the previous state carries forward. One
+        # position per side at most, so a limit of 0 drops the side's entries
+        sides = []
+        for entry_key, exit_key, name in (("entries", "exits", "long_max"),
+                ("short_entries", "short_exits", "short_max")):
+            limit = getattr(self, name)
+            entries = np.asarray(signals.get(entry_key, none), dtype=bool) & (size > 0) & (limit >= 1)
+            if limit > 1 and entries.any():
+                raise ValueError("run_vectorized() holds one position per side, {}={} needs run_compiled()"
+                    .format(name, limit))
+            exits = np.asarray(signals.get(exit_key, none), dtype=bool)
+            state = _ffill(np.where(entries, 1.0, np.where(exits, 0.0, np.nan))) == 1
+            before = np.concatenate(([False], state[:-1]))
+            closes = before & exits
+            opens = entries & (~before | closes)
+
+            quantity = np.where(state, _ffill(np.where(opens, size, np.nan)), 0.0)
+            quantity_before = np.concatenate(([0.0], quantity[:-1]))
+            sides.append((opens, closes, quantity, quantity_before))
+        (long_opens, long_closes, held, held_before), \
+            (short_opens, short_closes, owed, owed_before) = sides
+
+        # Cash flows in the order run() applies them: long exit, short exit,
+        # long entry, short entry, each as (notional, -commission)
+        flows = np.zeros((n, 8))
+        for slot, (active, quantity, sign) in enumerate((
+                (long_closes, held_before, 1.0), (short_closes, owed_before, -1.0),
+                (long_opens, held, -1.0), (short_opens, owed, 1.0))):
+            value = np.where(active, quantity * close, 0.0)
+            flows[:, 2*slot] = sign * value
+            flows[:, 2*slot + 1] = -np.where(active, commission * quantity * close, 0.0)
+
+        # Sequential cumulative sums reproduce the running balance exactly
+        balances = np.cumsum(np.concatenate(([self.capital], flows.ravel())))
+        before_fill = balances[:-1].reshape(n, 8)
+        balance = balances[8::8]
+        equity = balance + (held * close) - (owed * close)
+
+        # Orders run() could not afford would have been queued instead of filled
+        for slot, active, quantity in ((2, long_opens, held), (3, short_opens, owed)):
+            cost = quantity * close
+            available = before_fill[:, 2*slot]
+            unaffordable = active & ((cost > available) | \
+                (cost > available + flows[:, 2*slot + 1]))
+            if unaffordable.any():
+                raise ValueError("Insufficient balance for signal at bar {}.".format(
+                    np.flatnonzero(unaffordable)[0]))
+
+        # Stop at the first bar without equity, as run() does
+        ruined = np.flatnonzero(equity <= 0)
+        end = ruined[0] if ruined.size > 0 else n - 1
+        last = end if ruined.size > 0 else n # Bars counted in the statistics
+
+        self.index = end
+        self.balance = balance[end]
+        self.quantity_held = held[end]
+        self.quantity_owed = owed[end]
+        self.equity = equity[end]
+        self.equity_peak = max(self.capital, equity[:last].max()) if last > 0 else self.capital
+        self.long_count = int(held[end] > 0)
+        self.short_count = int(owed[end] > 0)
+        self.trade_duration = int(np.count_nonzero((held[:last] > 0) | (owed[:last] > 0)))
+        self.entered_positions = int(np.count_nonzero(long_opens[:end+1]) + \
+            np.count_nonzero(short_opens[:end+1]))
+        self.commission_total = np.cumsum(-flows[:end+1, 1::2].ravel())[-1] if end >= 0 else 0
+
+        # Fill history, in the order run() records it
+        equity_before = np.concatenate(([self.capital], equity[:-1]))
+        slots = ((long_closes, held_before, LONG_SELL), (short_closes, owed_before, SHORT_BUY),
+            (long_opens, held, LONG_BUY), (short_opens, owed, SHORT_SELL))
+        bars, slot = np.nonzero(np.stack([active[:end+1] for active, _, _ in slots], axis=1))
+        quantity = np.stack([quantity for _, quantity, _ in slots], axis=1)
+        self.history = Fills()
+        self.history.extend(bars, np.array([code for _, _, code in slots])[slot],
+            quantity[bars, slot], close[bars], before_fill[bars, 2*slot], equity_before[bars],
+            -flows[bars, 2*slot + 1])
+
+        self.allocate()
+        self.equity_curve[:end+1] = equity[:end+1]
+        self.cash_curve[:end+1] = balance[:end+1]
+        self.position_curve[:end+1] = held[:end+1] - owed[:end+1]
+        if ruined.size > 0:
+            if self.log is not None:
+                self.emit(WARNING, "ruin")
+        else:
+            # Liquidate all positions at the end
+            price = close[end]
+            if self.quantity_held > 0:
+                self.history.append(end, LONG_SELL, self.quantity_held, price, self.balance, self.equity, 0.0)
+                self.long_count -= 1
+                self.balance += self.quantity_held * price
+                self.quantity_held = 0
+            if self.quantity_owed > 0:
+                self.history.append(end, SHORT_BUY, self.quantity_owed, price, self.balance, self.equity, 0.0)
+                self.short_count -= 1
+                self.balance -= self.quantity_owed * price
+                self.quantity_owed = 0
+
+            self.equity = self.balance + (self.quantity_held * price) - \
+                    (self.quantity_owed * price) # Recalculate
+            self.record()
+
+        # Trades from the fills, as run() would have recorded them
+        self.ledger = Ledger(self.ledger.method).replay(self.history)
+
+    # Run the Signals strategy (market entries/exits, balance-sized entries and
+    # take-profit/stop-loss brackets) in the compiled engine, see compiled.py.
+    # Results are identical to run() with the Signals strategy at Close fills;
+    # intrabar fills (and so the oco rule) are only simulated by run()
+    def run_compiled(self, signals):
+        if self.intrabar:
+            raise ValueError("run_compiled() fills at the Close, intrabar=True needs run()")
+        self.signals = signals
+        n = self.length
+        none = np.zeros(n, dtype=bool)
+        arrays = [np.ascontiguousarray(signals.get(key, none), dtype=np.bool_)
+            for key in ("entries", "exits", "short_entries", "short_exits")]
+        per_bar = [np.ascontiguousarray(np.broadcast_to(np.asarray(signals.get(key, default), dtype=np.float64), (n,)))
+            for key, default in (("size", 1), ("take_profit", np.nan), ("stop_loss", np.nan))]
+        allocation = signals.get("allocation")
+
+        # Every order fills at most once: exits, entries and one bracket per entry, and liquidation
+        orders = sum(int(np.count_nonzero(values)) for values in arrays) + \
+            int(np.count_nonzero(arrays[0])) + int(np.count_nonzero(arrays[2])) + 2
+        state = np.zeros(6)
+        counts = np.zeros(9, dtype=np.int64)
+        fills = np.zeros((orders, 7))
+        book = np.zeros((orders, 8))
+        legs = np.zeros(orders, dtype=np.int64)
+        self.allocate()
+        compiled.run_signals(self.close, *arrays, per_bar[0], np.nan if allocation is None else float(allocation),
+            per_bar[1], per_bar[2], float(signals.get("commission", 0)), float(self.capital),
+            self.long_max, self.short_max, self.offset, state, counts, fills, book, legs,
+            self.equity_curve, self.cash_curve, self.position_curve)
+
+        self.index = int(counts[compiled.INDEX])
+        self.balance = state[compiled.BALANCE]
+        self.quantity_held = state[compiled.HELD]
+        self.quantity_owed = state[compiled.OWED]
+        self.equity = state[compiled.EQUITY]
+        self.equity_peak = state[compiled.PEAK]
+        self.commission_total = state[compiled.COMMISSION]
+        self.long_count = int(counts[compiled.LONGS])
+        self.short_count = int(counts[compiled.SHORTS])
+        self.entered_positions = int(counts[compiled.ENTERED])
+        self.trade_duration = int(counts[compiled.DURATION])
+
+        records = fills[:counts[compiled.FILLS]]
+        self.history = Fills()
+        self.history.extend(records[:, 0].astype(np.int64), records[:, 1].astype(np.int8), *records[:, 2:].T)
+        self.ledger = Ledger(self.ledger.method).replay(self.history)
+        if counts[compiled.RUINED] and self.log is not None:
+            self.emit(WARNING, "ruin")
+
+    def buy_and_hold(self):
+        return float(100*(self.price() - self.first_close)/self.first_close)
+
+    # Metrics printed by report(), None where undefined
+    def stats(self):
+        positions = self.entered_positions
+        stats = {
+            "Start": self.first_date,
+            "End": self.dates[-1],
+            "Equity Final [$]": float(self.equity),
+            "Equity Peak [$]": float(self.equity_peak),
+            "Arithmetic Return [%]": float(100*(self.equity - self.capital)/self.capital),
+            "Geometric Return [%]": None,
+            "Buy-and-hold Return [%]": self.buy_and_hold(),
+            "# Positions": positions,
+            "Win Rate [%]": None,
+            "Average Duration [t]": None,
+            "Commissions [$]": float(self.commission_total),
+            "Average Commission / Position [$]": None,
+        }
+        bars = self.offset - self.origin + self.index + 1 # Bars run
+        growth = annualised(self.capital, self.equity, bars) # See metrics.PERIODS
+        if growth is not None:
+            stats["Geometric Return [%]"] = float(100*growth)
+        if self.closed_positions > 0:
+            stats["Win Rate [%]"] = 100*self.winning_positions/self.closed_positions
+        if positions > 0:
+            stats["Average Duration [t]"] = self.trade_duration/positions
+            stats["Average Commission / Position [$]"] = float(self.commission_total/positions)
+        return stats
 
     def report(self):
         print("\n========================================")
-        print("Start: {}".format(self.data["Date"].iloc[0]))
-        print("End: {}".format(self.data["Date"].iloc[self.data.shape[0]-1]))
-        print("Equity Final [$]: {:.2f}".format(self.equity))
-        print("Equity Peak [$]: {:.2f}".format(self.equity_peak))
-        print("Arithmetic Return [%]: {:.2f}".format(100*(self.equity - self.capital)/self.capital))
-        print("Geometric Return [%]: {}".format("null"))
-        print("Buy-and-hold Return [%]: {:.2f}".format(100*(self.price() - self.data["Close"].iloc[0])/self.data["Close"].iloc[0]))
-        print("# Positions: {}".format(self.entered_positions))
-        if self.entered_positions == 0:
-            print("Win Rate [%]: null")
-            print("Average Duration [t]: null")
-        else:
-            print("Win Rate [%]: {:.2f}".format(100*self.winning_positions/self.entered_positions))
-            print("Average Duration [t]: {:.2f}".format(self.trade_duration/self.entered_positions))
-        print("Commissions [$]: {:.2f}".format(self.commission_total))
-        print("Average Commission / Position [$]: {:.2f}".format(self.commission_total/self.entered_positions))
+        for key, value in self.stats().items():
+            if value is None:
+                print("{}: null".format(key))
+            elif isinstance(value, (str, int)):
+                print("{}: {}".format(key, value))
+            else:
+                print("{}: {:.2f}".format(key, value))
+
+# Lightweight view of the current bar, e.g. bt.bar.high
+class Bar:
+    __slots__ = ("bt",)
+
+    def __init__(self, bt: Backtest):
+        self.bt = bt
+
+    def __getitem__(self, column):
+        return self.bt.columns[column][self.bt.index]
+
+    @property
+    def open(self):
+        return self.bt.open[self.bt.index]
+
+    @property
+    def high(self):
+        return self.bt.high[self.bt.index]
+
+    @property
+    def low(self):
+        return self.bt.low[self.bt.index]
+
+    @property
+    def close(self):
+        return self.bt.close[self.bt.index]
+
+    @property
+    def volume(self):
+        return self.bt.volume[self.bt.index]
 
 # -----------------------------------------------------------------------------
 
 class Order(metaclass=ABCMeta):
+    __slots__ = ("bt", "size", "limit", "commission", "margin", "leverage")
+    trigger = None # "below" or "above": side of the limit on which the order fills
+    code = None # Fill type recorded in the history
+
     def __init__(self, bt: Backtest, size: float, limit: float = None, 
         commission: float = 0, margin: float = 1):
         self.bt = bt
@@ -136,8 +678,9 @@ class Order(metaclass=ABCMeta):
     def add(self):
         pass
 
+    # Fill at price, by default the current Close
     @abstractmethod
-    def execute(self):
+    def execute(self, price=None):
         pass
     
     @abstractmethod
@@ -145,6 +688,10 @@ class Order(metaclass=ABCMeta):
         pass
  
 class LONGBUY(Order):
+    __slots__ = ()
+    trigger = "below"
+    code = LONG_BUY
+
     def __init__(self, bt: Backtest, size: float, limit: float = None, 
         commission: float = 0, margin: float = 1):
         super().__init__(bt, size, limit, commission, margin)
@@ -170,36 +717,43 @@ class LONGBUY(Order):
 
         return True
 
-    def execute(self):
-        if self.size * self.bt.price() > self.bt.balance:
+    def execute(self, price=None):
+        price = self.bt.price() if price is None else price
+        if self.size * price > self.bt.balance:
             # print("Insufficient balance to buy.")
             return False
-        commission_amount = self.commission * self.size * self.bt.price()
-        if self.size * self.bt.price() > self.bt.balance - commission_amount:
-            print("Not enough balance to include commission payment.")
+        commission_amount = self.commission * self.size * price
+        if self.size * price > self.bt.balance - commission_amount:
+            if self.bt.log is not None:
+                self.bt.emit(WARNING, "commission")
             return False
         
         # Consider Limit
         if self.limit != None:
-            if self.bt.price() > self.limit:
+            if price > self.limit:
                 return False
 
         # Statistics
         self.bt.entered_positions += 1
-        self.bt.history.append("LONG BUY: Q: {}, C: {}, B: {}, E: {}".format(self.size, self.bt.price(), self.bt.balance, self.bt.equity))
+        bar = self.bt.offset + self.bt.index
+        self.bt.history.append(bar, self.code, self.size, price, self.bt.balance, self.bt.equity,
+            commission_amount)
+        self.bt.ledger.fill(self.code, self.size, price, commission_amount, bar)
 
         self.bt.quantity_held += self.size
-        self.bt.balance -= self.size * self.bt.price()
+        self.bt.balance -= self.size * price
         self.bt.balance -= commission_amount
         self.bt.commission_total += commission_amount
-        print("LONG BUY")
-
-        # Save Trade
-        self.bt.previous_long = self.size * self.bt.price()
+        if self.bt.log is not None:
+            self.bt.emit(INFO, "fill", type=NAMES[self.code], quantity=self.size, price=price)
 
         return True
     
 class LONGSELL(Order):
+    __slots__ = ()
+    trigger = "above"
+    code = LONG_SELL
+
     def __init__(self, bt: Backtest, size: float, limit: float = None, 
         commission: float = 0, margin: float = 1):
         super().__init__(bt, size, limit, commission, margin)
@@ -223,40 +777,46 @@ class LONGSELL(Order):
         
         return True
 
-    def execute(self):
+    def execute(self, price=None):
+        price = self.bt.price() if price is None else price
         if self.size <= 0:
             # print("Order size must be positive.")
             return False
         if self.size > self.bt.quantity_held:
             # print("Attempting to sell more than held.")
             return False
-        commission_amount = self.commission * self.size * self.bt.price()
-        if commission_amount > self.bt.balance + self.size * self.bt.price():
-            print("Not enough balance to include commission payment.")
+        commission_amount = self.commission * self.size * price
+        if commission_amount > self.bt.balance + self.size * price:
+            if self.bt.log is not None:
+                self.bt.emit(WARNING, "commission")
             return False
         
         # Consider Limit
         if self.limit != None:
-            if self.bt.price() < self.limit:
+            if price < self.limit:
                 return False
 
         # Statistics
         self.bt.long_count -= 1
-        self.bt.history.append("LONG SELL: Q: {}, C: {}, B: {}, E: {}".format(self.size, self.bt.price(), self.bt.balance, self.bt.equity))
+        bar = self.bt.offset + self.bt.index
+        self.bt.history.append(bar, self.code, self.size, price, self.bt.balance, self.bt.equity,
+            commission_amount)
+        self.bt.ledger.fill(self.code, self.size, price, commission_amount, bar)
 
         self.bt.quantity_held -= self.size
-        self.bt.balance += self.size * self.bt.price()
+        self.bt.balance += self.size * price
         self.bt.balance -= commission_amount
         self.bt.commission_total += commission_amount
-        print("LONG SELL")
-
-        # Winning Trades
-        if self.size * self.bt.price() > self.bt.previous_long:
-            self.bt.winning_positions += 1
+        if self.bt.log is not None:
+            self.bt.emit(INFO, "fill", type=NAMES[self.code], quantity=self.size, price=price)
 
         return True
 
 class SHORTSELL(Order):
+    __slots__ = ()
+    trigger = "above"
+    code = SHORT_SELL
+
     def __init__(self, bt: Backtest, size: float, limit: float = None, 
         commission: float = 0, margin: float = 1):
         super().__init__(bt, size, limit, commission, margin)
@@ -282,36 +842,43 @@ class SHORTSELL(Order):
         
         return True
     
-    def execute(self):
-        if self.size * self.bt.price() > self.bt.balance:
+    def execute(self, price=None):
+        price = self.bt.price() if price is None else price
+        if self.size * price > self.bt.balance:
             # print("Insufficient balance held to conduct a short sell.")
             return False
-        commission_amount = self.commission * self.size * self.bt.price()
-        if self.size * self.bt.price() > self.bt.balance - commission_amount:
-            print("Not enough balance to include commission payment.")
+        commission_amount = self.commission * self.size * price
+        if self.size * price > self.bt.balance - commission_amount:
+            if self.bt.log is not None:
+                self.bt.emit(WARNING, "commission")
             return False
 
         # Consider Limit
         if self.limit != None:
-            if self.bt.price() < self.limit:
+            if price < self.limit:
                 return False
 
         # Statistics
         self.bt.entered_positions += 1
-        self.bt.history.append("SHORT SELL: Q: {}, C: {}, B: {}, E: {}".format(self.size, self.bt.price(), self.bt.balance, self.bt.equity))
+        bar = self.bt.offset + self.bt.index
+        self.bt.history.append(bar, self.code, self.size, price, self.bt.balance, self.bt.equity,
+            commission_amount)
+        self.bt.ledger.fill(self.code, self.size, price, commission_amount, bar)
         
         self.bt.quantity_owed += self.size
-        self.bt.balance += self.size * self.bt.price()
+        self.bt.balance += self.size * price
         self.bt.balance -= commission_amount
         self.bt.commission_total += commission_amount
-        print("SHORT SELL")
-
-        # Save Trade
-        self.bt.previous_short = self.size * self.bt.price()
+        if self.bt.log is not None:
+            self.bt.emit(INFO, "fill", type=NAMES[self.code], quantity=self.size, price=price)
 
         return True
 
 class SHORTBUY(Order):
+    __slots__ = ()
+    trigger = "below"
+    code = SHORT_BUY
+
     def __init__(self, bt: Backtest, size: float, limit: float = None, 
         commission: float = 0, margin: float = 1):
         super().__init__(bt, size, limit, commission, margin)
@@ -335,41 +902,47 @@ class SHORTBUY(Order):
         
         return True
     
-    def execute(self):
+    def execute(self, price=None):
+        price = self.bt.price() if price is None else price
         if self.size <= 0:
             # print("Order size must be positive.")
             return False
         if self.size > self.bt.quantity_owed:
             # print("Attempting to buy back more than owed.")
             return False
-        commission_amount = self.commission * self.size * self.bt.price()
-        if commission_amount > self.bt.balance + self.size * self.bt.price():
-            print("Not enough balance to include commission payment.")
+        commission_amount = self.commission * self.size * price
+        if commission_amount > self.bt.balance + self.size * price:
+            if self.bt.log is not None:
+                self.bt.emit(WARNING, "commission")
             return False
 
         # Consider Limit
         if self.limit != None:
-            if self.bt.price() > self.limit:
+            if price > self.limit:
                 return False
 
         # Statistics
         self.bt.short_count -= 1
-        self.bt.history.append("SHORT BUY: Q: {}, C: {}, B: {}, E: {}".format(self.size, self.bt.price(), self.bt.balance, self.bt.equity))
+        bar = self.bt.offset + self.bt.index
+        self.bt.history.append(bar, self.code, self.size, price, self.bt.balance, self.bt.equity,
+            commission_amount)
+        self.bt.ledger.fill(self.code, self.size, price, commission_amount, bar)
 
         self.bt.quantity_owed -= self.size
-        self.bt.balance -= self.size * self.bt.price()
+        self.bt.balance -= self.size * price
         self.bt.balance -= commission_amount
         self.bt.commission_total += commission_amount
-        print("SHORT BUY")
-
-        # Winning Trades        
-        if self.size * self.bt.price() < self.bt.previous_short:
-            self.bt.winning_positions += 1
+        if self.bt.log is not None:
+            self.bt.emit(INFO, "fill", type=NAMES[self.code], quantity=self.size, price=price)
 
         return True
 
 # Stop Loss for Long
 class STOPSELL(Order): 
+    __slots__ = ()
+    trigger = "below"
+    code = STOP_SELL
+
     def __init__(self, bt: Backtest, size: float, limit: float, 
         commission: float = 0, margin: float = 1):
         super().__init__(bt, size, limit, commission, margin)
@@ -393,33 +966,43 @@ class STOPSELL(Order):
         
         return True
 
-    def execute(self):
+    def execute(self, price=None):
+        price = self.bt.price() if price is None else price
         if self.size > self.bt.quantity_held:
             # print("Attempting to sell more than held.")
             return False
-        commission_amount = self.commission * self.size * self.bt.price()
-        if commission_amount > self.bt.balance + self.size * self.bt.price():
-            print("Not enough balance to include commission payment.")
+        commission_amount = self.commission * self.size * price
+        if commission_amount > self.bt.balance + self.size * price:
+            if self.bt.log is not None:
+                self.bt.emit(WARNING, "commission")
             return False
         
         # Consider Long Stop Limit
-        if self.bt.price() > self.limit:
+        if price > self.limit:
             return False
 
         # Statistics
         self.bt.long_count -= 1
-        self.bt.history.append("STOP SELL: Q: {}, C: {}, B: {}, E: {}".format(self.size, self.bt.price(), self.bt.balance, self.bt.equity))
+        bar = self.bt.offset + self.bt.index
+        self.bt.history.append(bar, self.code, self.size, price, self.bt.balance, self.bt.equity,
+            commission_amount)
+        self.bt.ledger.fill(self.code, self.size, price, commission_amount, bar)
 
         self.bt.quantity_held -= self.size
-        self.bt.balance += self.size * self.bt.price()
+        self.bt.balance += self.size * price
         self.bt.balance -= commission_amount
         self.bt.commission_total += commission_amount
-        print("STOP SELL")
+        if self.bt.log is not None:
+            self.bt.emit(INFO, "fill", type=NAMES[self.code], quantity=self.size, price=price)
 
         return True
 
 # Stop Loss for Short
 class STOPBUY(Order): 
+    __slots__ = ()
+    trigger = "above"
+    code = STOP_BUY
+
     def __init__(self, bt: Backtest, size: float, limit: float, 
         commission: float = 0, margin: float = 1):
         super().__init__(bt, size, limit, commission, margin)
@@ -443,33 +1026,41 @@ class STOPBUY(Order):
         
         return True
     
-    def execute(self):
+    def execute(self, price=None):
+        price = self.bt.price() if price is None else price
         if self.size > self.bt.quantity_owed:
             # print("Attempting to buy back more than owed.")
             return False
-        commission_amount = self.commission * self.size * self.bt.price()
-        if commission_amount > self.bt.balance + self.size * self.bt.price():
-            print("Not enough balance to include commission payment.")
+        commission_amount = self.commission * self.size * price
+        if commission_amount > self.bt.balance + self.size * price:
+            if self.bt.log is not None:
+                self.bt.emit(WARNING, "commission")
             return False
 
         # Consider Stop Buy Limit
-        if self.bt.price() < self.limit:
+        if price < self.limit:
             return False
 
         # Statistics
         self.bt.short_count -= 1
-        self.bt.history.append("STOP BUY: Q: {}, C: {}, B: {}, E: {}".format(self.size, self.bt.price(), self.bt.balance, self.bt.equity))
+        bar = self.bt.offset + self.bt.index
+        self.bt.history.append(bar, self.code, self.size, price, self.bt.balance, self.bt.equity,
+            commission_amount)
+        self.bt.ledger.fill(self.code, self.size, price, commission_amount, bar)
 
         self.bt.quantity_owed -= self.size
-        self.bt.balance -= self.size * self.bt.price()
+        self.bt.balance -= self.size * price
         self.bt.balance -= commission_amount
         self.bt.commission_total += commission_amount
-        print("STOP BUY")
+        if self.bt.log is not None:
+            self.bt.emit(INFO, "fill", type=NAMES[self.code], quantity=self.size, price=price)
 
         return True
 
 # One-Cancels-the-Other order pair.
 class OCO:
+    __slots__ = ("bt", "order1", "order2")
+
     def __init__(self, bt: Backtest, order1, order2):
         self.bt = bt
         self.order1 = order1
@@ -481,64 +1072,80 @@ class OCO:
         if self.order2.valid() == False:
             return False
         
-        print("Added OCO order.")
+        if self.bt.log is not None:
+            self.bt.emit(INFO, "oco")
         self.bt.trades.append(self)
         return True
 
-    def execute(self):
-        if self.order1.execute():
-            print("{} cancelled due to OCO.".format(type(self.order2)))
-            return True
-        if self.order2.execute():
-            print("{} cancelled due to OCO.".format(type(self.order1)))
-            return True
+    # Legs as (order, price) in the order to try them, by default order1 then
+    # order2 at the Close
+    def execute(self, legs=None):
+        for order, price in legs or ((self.order1, None), (self.order2, None)):
+            if order.execute(price):
+                if self.bt.log is not None:
+                    other = self.order2 if order is self.order1 else self.order1
+                    self.bt.emit(INFO, "cancel", cancelled=type(other))
+                return True
         return False
 
+# Order types timed per class by the profiler
+ORDERS = (LONGBUY, LONGSELL, SHORTSELL, SHORTBUY, STOPSELL, STOPBUY, OCO)
+
 # =============================================================================
 # Function Definitions
 
 def RSI(bt):
+    period = bt.params.get("rsi_period", 14)
+    commission = bt.params.get("commission", 0.002)
+
     # For n periods, RSI requires at least n+1 data points.
-    if bt.index < 15: 
+    if bt.index < period + 1: 
         return
     
-    nparray = bt.data["Close"].iloc[bt.index-15:bt.index].to_numpy()
-    rsi = talib.RSI(nparray, 14)[-1]
-    print("RSI: {:.2f}".format(rsi)) 
-    if rsi > 70:
+    rsi = bt.indicator("RSI", period)[bt.index]
+    if bt.log is not None:
+        bt.emit(DEBUG, "indicator", name="RSI", value=rsi)
+    if rsi > bt.params.get("upper", 70):
         # LONGSELL(bt, bt.quantity_held).add()
         # SHORTSELL(bt, math.floor(bt.balance/bt.price())).add()
-        LONGSELL(bt, 1, commission=0.002).add()
-        SHORTSELL(bt, 1, commission=0.002).add()
+        LONGSELL(bt, 1, commission=commission).add()
+        SHORTSELL(bt, 1, commission=commission).add()
 
-    if rsi < 30:
-        SHORTBUY(bt, 1, commission=0.002).add()
-        LONGBUY(bt, 1, commission=0.002).add()
+    if rsi < bt.params.get("lower", 30):
+        SHORTBUY(bt, 1, commission=commission).add()
+        LONGBUY(bt, 1, commission=commission).add()
         # SHORTBUY(bt, bt.quantity_owed).add()
         # LONGBUY(bt, math.floor(bt.balance/bt.price())).add()
 
 def ATR(bt):
-    if bt.index < 15: # Assumes n+1 periods
+    period = bt.params.get("atr_period", 14)
+    if bt.index < period + 1: # Assumes n+1 periods
         return
     
-    high = bt.data["High"].iloc[bt.index-15:bt.index].to_numpy()
-    low = bt.data["Low"].iloc[bt.index-15:bt.index].to_numpy()
-    close = bt.data["Close"].iloc[bt.index-15:bt.index].to_numpy()
-    atr = talib.ATR(high, low, close, timeperiod=14)[-1]
+    atr = bt.indicator("ATR", period)[bt.index]
 
     #print("ATR: {:.2f}".format(atr))
     return atr
 
 def SMACrossover(bt):
-    if bt.index < 21 or bt.index >= bt.data.shape[0]-1: # Assumes n+1 periods, and ignore final
+    short = bt.params.get("sma_short", 10)
+    long = bt.params.get("sma_long", 20)
+    multiplier = bt.params.get("atr_mult", 1.5)
+    commission = bt.params.get("commission", 0.002)
+    allocation = bt.params.get("allocation", 0.998) # Fraction of balance per entry
+    window = long + 1
+
+    if bt.index < window or bt.index >= bt.length-1: # Assumes n+1 periods, and ignore final
         return
 
-    nparray = bt.data["Close"].iloc[bt.index-21:bt.index].to_numpy()
-    short_sma = talib.SMA(nparray, 10)
-    long_sma = talib.SMA(nparray, 20)
+    # Last two values of each SMA over the trailing n+1 bars
+    short_sma = bt.indicator("SMA", short, window)[bt.index]
+    short_prev = bt.indicator("SMA", short, window, 1)[bt.index]
+    long_sma = bt.indicator("SMA", long, window)[bt.index]
+    long_prev = bt.indicator("SMA", long, window, 1)[bt.index]
 
-    sma_buy = ((short_sma[-2] <= long_sma[-2]) and (short_sma[-1] >= long_sma[-1]))
-    sma_sell = ((short_sma[-2] >= long_sma[-1]) and (short_sma[-1] <= long_sma[-1]))
+    sma_buy = ((short_prev <= long_prev) and (short_sma >= long_sma))
+    sma_sell = ((short_prev >= long_sma) and (short_sma <= long_sma))
 
     atr = ATR(bt)
 
@@ -548,11 +1155,11 @@ def SMACrossover(bt):
         # SHORTBUY(bt, bt.quantity_owed).add()
         # LONGBUY(bt, math.floor(bt.balance/bt.price())).add()
 
-        success = LONGBUY(bt, math.floor(0.998*bt.balance/bt.price()), commission=0.002).add()
+        success = LONGBUY(bt, math.floor(allocation*bt.balance/bt.price()), commission=commission).add()
         # success = LONGBUY(bt, math.floor(bt.balance/bt.price())).add()
         if success:
-            tp = LONGSELL(bt, bt.quantity_held, limit = bt.price() + 1.5*atr, commission=0.002)
-            sl = STOPSELL(bt, bt.quantity_held, limit = bt.price() - 1.5*atr, commission=0.002)
+            tp = LONGSELL(bt, bt.quantity_held, limit = bt.price() + multiplier*atr, commission=commission)
+            sl = STOPSELL(bt, bt.quantity_held, limit = bt.price() - multiplier*atr, commission=commission)
             OCO(bt, tp, sl).add()
 
     elif sma_sell == True:
@@ -560,17 +1167,154 @@ def SMACrossover(bt):
         # SHORTSELL(bt, 1).add()
         # LONGSELL(bt, bt.quantity_held, commission=0.002).add()
 
-        success = SHORTSELL(bt, math.floor(0.998*bt.balance/bt.price()), commission=0.002).add()
+        success = SHORTSELL(bt, math.floor(allocation*bt.balance/bt.price()), commission=commission).add()
         # success = SHORTSELL(bt, math.floor(bt.balance/bt.price())).add()
         if success:
-            tp = SHORTBUY(bt, bt.quantity_owed, limit = bt.price() - 1.5*atr, commission=0.002)
-            sl = STOPBUY(bt, bt.quantity_owed, limit = bt.price() + 1.5*atr, commission=0.002)
+            tp = SHORTBUY(bt, bt.quantity_owed, limit = bt.price() - multiplier*atr, commission=commission)
+            sl = STOPBUY(bt, bt.quantity_owed, limit = bt.price() + multiplier*atr, commission=commission)
             OCO(bt, tp, sl).add()
+
+# Place the orders described by bt.signals, the event-loop counterpart of
+# Backtest.run_vectorized and Backtest.run_compiled. Besides the entry/exit
+# arrays, signals may give an allocation (enter with that fraction of the
+# balance instead of size), and take_profit/stop_loss distances from the entry
+# price for an exit bracket placed after each entry (an OCO pair when both are
+# given, NaN for none).
+def Signals(bt):
+    signals = bt.signals
+    i = bt.index
+    commission = signals.get("commission", 0)
+    if "exits" in signals and signals["exits"][i]:
+        LONGSELL(bt, bt.quantity_held, commission=commission).add()
+    if "short_exits" in signals and signals["short_exits"][i]:
+        SHORTBUY(bt, bt.quantity_owed, commission=commission).add()
+
+    size = signals.get("size", 1)
+    if np.ndim(size) > 0:
+        size = size[i]
+    allocation = signals.get("allocation")
+    if "entries" in signals and signals["entries"][i]:
+        if allocation is not None:
+            size = math.floor(allocation*bt.balance/bt.price())
+        if LONGBUY(bt, size, commission=commission).add():
+            _bracket(bt, signals, LONGSELL, STOPSELL, bt.quantity_held, commission)
+    if "short_entries" in signals and signals["short_entries"][i]:
+        if allocation is not None:
+            size = math.floor(allocation*bt.balance/bt.price())
+        if SHORTSELL(bt, size, commission=commission).add():
+            _bracket(bt, signals, SHORTBUY, STOPBUY, bt.quantity_owed, commission)
+
+def _bracket(bt, signals, take, stop, size, commission):
+    take_profit = _at(signals.get("take_profit", np.nan), bt.index)
+    stop_loss = _at(signals.get("stop_loss", np.nan), bt.index)
+    price = bt.price()
+    if take is LONGSELL: # Take profit above a long, below a short
+        take_limit, stop_limit = price + take_profit, price - stop_loss
+    else:
+        take_limit, stop_limit = price - take_profit, price + stop_loss
+    if take_profit == take_profit and stop_loss == stop_loss:
+        OCO(bt, take(bt, size, limit=take_limit, commission=commission),
+            stop(bt, size, limit=stop_limit, commission=commission)).add()
+    elif take_profit == take_profit:
+        take(bt, size, limit=take_limit, commission=commission).add()
+    elif stop_loss == stop_loss:
+        stop(bt, size, limit=stop_limit, commission=commission).add()
+
+def _at(value, i): # Scalar or per-bar array
+    return value[i] if np.ndim(value) > 0 else value
+
+# Strategy from a declarative spec (see spec.py), compiled to signal arrays
+# before the bars and placed by Signals. The same arrays run in the fast paths:
+# bt.run_compiled(SMACrossoverSpec.signals(bt))
+class Spec:
+    def __init__(self, spec, name):
+        self.spec = spec
+        self.params = spec.get("params", {}) # Defaults, as function strategies declare them
+        self.__name__ = self.__qualname__ = name # Named like a strategy function
+
+    def indicators(self, bt):
+        return spec_indicators(self.spec, bt)
+
+    def lookback(self, bt):
+        return spec_lookback(self.spec, bt)
+
+    def signals(self, bt):
+        return compile_spec(self.spec, bt)
+
+    def prepare(self, bt):
+        bt.signals = self.signals(bt)
+
+    def __call__(self, bt):
+        Signals(bt)
+
+RSISpec = Spec(RSI_SPEC, "RSISpec")
+SMACrossoverSpec = Spec(SMA_CROSSOVER_SPEC, "SMACrossoverSpec")
+
+# SMA crossover with fixed sizing and no brackets as signal arrays
+def SMACrossoverSignals(bt, size=1, commission=0.002, long_only=False):
+    short = bt.params.get("sma_short", 10)
+    long = bt.params.get("sma_long", 20)
+    window = long + 1
+    short_sma = bt.indicator("SMA", short, window)
+    short_prev = bt.indicator("SMA", short, window, 1)
+    long_sma = bt.indicator("SMA", long, window)
+    long_prev = bt.indicator("SMA", long, window, 1)
+
+    sma_buy = (short_prev <= long_prev) & (short_sma >= long_sma)
+    sma_sell = (short_prev >= long_sma) & (short_sma <= long_sma) & ~sma_buy
+    sma_buy[-1] = sma_sell[-1] = False # Ignore final
+
+    signals = {"entries": sma_buy, "exits": sma_sell, "size": size, "commission": commission}
+    if not long_only:
+        signals["short_entries"] = sma_sell
+        signals["short_exits"] = sma_buy
+    return signals
+
+# SMACrossover as signal arrays: balance-sized entries with an ATR bracket
+def SMACrossoverBrackets(bt):
+    short = bt.params.get("sma_short", 10)
+    long = bt.params.get("sma_long", 20)
+    multiplier = bt.params.get("atr_mult", 1.5)
+    window = long + 1
+    short_sma = bt.indicator("SMA", short, window)
+    short_prev = bt.indicator("SMA", short, window, 1)
+    long_sma = bt.indicator("SMA", long, window)
+    long_prev = bt.indicator("SMA", long, window, 1)
+    distance = multiplier*bt.indicator("ATR", bt.params.get("atr_period", 14))
+
+    sma_buy = (short_prev <= long_prev) & (short_sma >= long_sma)
+    sma_sell = (short_prev >= long_sma) & (short_sma <= long_sma) & ~sma_buy
+    sma_buy[:window] = sma_sell[:window] = False
+    sma_buy[-1] = sma_sell[-1] = False # Ignore final
+
+    return {"entries": sma_buy, "short_entries": sma_sell, "commission": bt.params.get("commission", 0.002),
+        "allocation": bt.params.get("allocation", 0.998), "take_profit": distance, "stop_loss": distance}
+
+# Indicators each strategy reads, computed before the run starts
+RSI.indicators = lambda bt: (("RSI", bt.params.get("rsi_period", 14)),)
+ATR.indicators = lambda bt: (("ATR", bt.params.get("atr_period", 14)),)
+
+def _sma_indicators(bt):
+    short = bt.params.get("sma_short", 10)
+    long = bt.params.get("sma_long", 20)
+    window = long + 1
+    return ((("SMA", short, window), ("SMA", short, window, 1), ("SMA", long, window),
+        ("SMA", long, window, 1)) + ATR.indicators(bt))
+
+SMACrossover.indicators = _sma_indicators
+
+# Default parameters each strategy reads, recorded with its results (see store.record)
+RSI.params = {"rsi_period": 14, "upper": 70, "lower": 30, "commission": 0.002}
+ATR.params = {"atr_period": 14}
+SMACrossover.params = {"sma_short": 10, "sma_long": 20, "atr_mult": 1.5, "atr_period": 14, "commission": 0.002,
+    "allocation": 0.998}
         
 # =============================================================================
 
 if __name__ == "__main__":
-    bt = Backtest("datasets/GOOG.csv", SMACrossover, 10000)
+    step = len(sys.argv) == 2 and sys.argv[1] == "1" # Step through bars with enter
+    bt = Backtest("datasets/GOOG.csv", SMACrossover, 10000, log=print_log,
+        log_level=DEBUG if step else INFO, step=step)
     bt.run()
     bt.report()
     
@@ -0,0 +1,75 @@
+import pandas as pd
+
+from backtest import Backtest
+
+# =============================================================================
+# Batched Accounts
+#
+# Runs K strategy accounts in lockstep over one pass of the same data. The
+# dataset is loaded once and every account reads the same column arrays, one
+# shared indicator cache (entries are keyed by name and parameters, so an
+# indicator two accounts declare is computed once) and the same higher
+# timeframes. Each account is a full Backtest with its own balance, positions,
+# order book and history, advanced bar by bar with next(); accounts that run
+# out of equity drop out while the others continue.
+
+class Batch:
+    # accounts: a list of strategies, or a dict of name: strategy or
+    # name: (strategy, options) where options override the shared ones
+    # (capital, long_max, short_max, params, ...) for that account
+    def __init__(self, datapath, accounts, capital, **options):
+        if not isinstance(accounts, dict):
+            accounts = self._named(accounts)
+
+        self.accounts = {}
+        source = datapath
+        indicators = {}
+        timeframes = {}
+        for name, spec in accounts.items():
+            strategy, overrides = spec if isinstance(spec, tuple) else (spec, {})
+            settings = dict(options, capital=capital)
+            settings.update(overrides)
+            bt = Backtest(source, strategy, settings.pop("capital"), **settings)
+            source = bt.source # Later accounts reuse the loaded columns
+            bt.indicators = indicators
+            bt.timeframes = timeframes
+            self.accounts[name] = bt
+
+    # Accounts named after their strategy, numbered from the second repeat on
+    @staticmethod
+    def _named(strategies):
+        accounts = {}
+        for strategy in strategies:
+            name = strategy.__name__
+            n = 2
+            while name in accounts:
+                name = "{}#{}".format(strategy.__name__, n)
+                n += 1
+            accounts[name] = strategy
+        return accounts
+
+    def __getitem__(self, name):
+        return self.accounts[name]
+
+    def run(self):
+        active = list(self.accounts.values())
+        for bt in active:
+            bt.precompute(bt.strategy)
+            bt.allocate()
+
+        length = active[0].length if active else 0
+        for _ in range(length):
+            active = [bt for bt in active if bt.next() != False]
+            if not active:
+                return
+        for bt in active:
+            bt.liquidate()
+
+    # One row of stats() per account
+    def stats(self):
+        return pd.DataFrame([dict(Account=name, **bt.stats()) for name, bt in self.accounts.items()])
+
+    def report(self):
+        for name, bt in self.accounts.items():
+            print("\n" + name, end="")
+            bt.report()
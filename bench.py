@@ -0,0 +1,151 @@
+import numpy as np
+
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+
+import backtest
+from backtest import Backtest
+
+# =============================================================================
+# Benchmarks
+#
+# Times the strategies on deterministic synthetic OHLCV series (a seeded
+# random walk) of increasing length, measures peak memory per bar with
+# tracemalloc, and records the results each run produces. Output is JSON, and
+# can be saved as a baseline that later runs are checked against: results
+# must reproduce exactly, and with --time-tolerance timings must not regress.
+#
+#   python bench.py --save bench_baseline.json
+#   python bench.py --baseline bench_baseline.json [--time-tolerance 0.25]
+
+SIZES = (1000, 10000, 100000, 1000000)
+CASES = ("RSI", "SMACrossover", "SMACrossover:compiled")
+CAPITAL = 10000
+SIGNALS = {"SMACrossover": backtest.SMACrossoverBrackets} # Strategies as signals, for the compiled engine
+
+def synthetic(bars, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100*np.exp(np.cumsum(rng.normal(0.0002, 0.01, bars)))
+    open = np.concatenate(([100.0], close[:-1]))*np.exp(rng.normal(0, 0.002, bars))
+    spread = np.abs(rng.normal(0, 0.005, (2, bars)))
+    high = np.maximum(open, close)*(1 + spread[0])
+    low = np.minimum(open, close)*(1 - spread[1])
+    volume = np.floor(rng.lognormal(12, 0.5, bars))
+    return {"Date": np.arange(bars), "Open": open, "High": high, "Low": low, "Close": close,
+        "Volume": volume}
+
+def _run(case, data):
+    name, _, engine = case.partition(":")
+    if engine == "compiled":
+        bt = Backtest(data, backtest.Signals, CAPITAL)
+        bt.run_compiled(SIGNALS[name](bt))
+    else:
+        bt = Backtest(data, getattr(backtest, name), CAPITAL)
+        bt.run()
+    return bt
+
+def results(bt):
+    stats = bt.stats()
+    return {"Equity Final [$]": stats["Equity Final [$]"], "# Positions": stats["# Positions"],
+        "Win Rate [%]": stats["Win Rate [%]"], "Fills": len(bt.history),
+        "Held": float(bt.quantity_held), "Owed": float(bt.quantity_owed)}
+
+def measure(case, bars, repeat=1, memory=True):
+    data = synthetic(bars)
+    if case.endswith(":compiled"):
+        _run(case, synthetic(1000)) # Compile outside the timing
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        bt = _run(case, data)
+        times.append(time.perf_counter() - start)
+    row = {"case": case, "bars": bars, "seconds": min(times), "bars_per_second": bars/min(times)}
+    if memory:
+        tracemalloc.start()
+        _run(case, data)
+        row["peak_bytes_per_bar"] = tracemalloc.get_traced_memory()[1]/bars
+        tracemalloc.stop()
+    row["results"] = results(bt)
+    return row
+
+# Differences from a baseline, and between each engine and run(), as messages
+def compare(rows, baseline=None, time_tolerance=None):
+    reference = {(row["case"], row["bars"]): row for row in rows}
+    problems = []
+    for row in rows:
+        name, _, engine = row["case"].partition(":")
+        base = reference.get((name, row["bars"]))
+        if engine and base is not None and row["results"] != base["results"]:
+            problems.append("{} {} bars: results {} differ from run() {}".format(row["case"], row["bars"],
+                row["results"], base["results"]))
+    if baseline is None:
+        return problems
+
+    expected = {(row["case"], row["bars"]): row for row in baseline["runs"]}
+    for row in rows:
+        base = expected.get((row["case"], row["bars"]))
+        if base is None:
+            continue
+        if row["results"] != base["results"]:
+            problems.append("{} {} bars: results {} != {}".format(row["case"], row["bars"],
+                row["results"], base["results"]))
+        if time_tolerance is not None and row["seconds"] > base["seconds"]*(1 + time_tolerance):
+            problems.append("{} {} bars: {:.4f}s, baseline {:.4f}s".format(row["case"], row["bars"],
+                row["seconds"], base["seconds"]))
+    return problems
+
+def environment():
+    versions = {"python": platform.python_version(), "numpy": np.__version__,
+        "platform": platform.platform(), "compiled": backtest.compiled.COMPILED}
+    try:
+        import numba
+        versions["numba"] = numba.__version__
+    except ImportError:
+        pass
+    return versions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the backtest engines.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(SIZES),
+        help="Bars per series, e.g. 1000 10000000")
+    parser.add_argument("--cases", nargs="+", default=list(CASES))
+    parser.add_argument("--repeat", type=int, default=1, help="Timed runs per case, the best is kept")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the traced memory run")
+    parser.add_argument("--output", help="Write the JSON here instead of stdout")
+    parser.add_argument("--save", help="Write the JSON as a baseline file")
+    parser.add_argument("--baseline", help="Check results (and timings) against this baseline")
+    parser.add_argument("--time-tolerance", type=float, default=None,
+        help="Allowed slowdown against the baseline, e.g. 0.25")
+    args = parser.parse_args(argv)
+
+    rows = []
+    for bars in args.sizes:
+        for case in args.cases:
+            row = measure(case, bars, args.repeat, not args.no_memory)
+            rows.append(row)
+            print("{:<24}{:>10} bars {:>10.4f}s".format(case, bars, row["seconds"]), file=sys.stderr)
+    report = {"environment": environment(), "runs": rows}
+
+    text = json.dumps(report, indent=1)
+    for path in (args.output, args.save):
+        if path:
+            with open(path, "w") as file:
+                file.write(text + "\n")
+    if not args.output and not args.save:
+        print(text)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    problems = compare(rows, baseline, args.time_tolerance)
+    for problem in problems:
+        print("REGRESSION: " + problem, file=sys.stderr)
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import numpy as np
+
+import sys
+import argparse
+
+import backtest
+from backtest import Backtest
+from batch import Batch
+from bench import synthetic
+from portfolio import Portfolio
+from stream import StreamBacktest
+from walkforward import walk_forward, windows
+
+# =============================================================================
+# Equivalence Checks
+#
+# Runs the claims the engines make about each other on synthetic data and
+# reports any that fail: run() with the Signals strategy against
+# run_vectorized() and run_compiled() (fills, equity curve and stats
+# bit-for-bit, including position limits), streaming against in-memory runs,
+# restoring a snapshot mid-run against an uninterrupted run, a Batch against
+# separate runs, a one-symbol Portfolio against a Backtest (and the stats of a
+# two-symbol one against its assets), and walk-forward equity chaining for any
+# step. Exits with status 1 if a check fails.
+#
+#   python check.py [--bars 5000] [--seed 0]
+
+CAPITAL = 10000
+
+# Fill records without the int formatting bits, which the engines may set differently
+def _fills(bt):
+    records = bt.history.records
+    return [records[name] for name in records.dtype.names if name != "ints"]
+
+# Whether two finished backtests agree on every fill, the per-bar series (unless
+# b kept none, as when streaming) and stats
+def same(a, b):
+    if len(a.history) != len(b.history) or a.equity != b.equity or a.stats() != b.stats():
+        return False
+    if not all(np.array_equal(x, y) for x, y in zip(_fills(a), _fills(b))):
+        return False
+    return b.equity_curve is None or np.array_equal(a.series().to_numpy(), b.series().to_numpy(), equal_nan=True)
+
+def _signals(name, bt):
+    if name == "SMACrossoverSignals":
+        return backtest.SMACrossoverSignals(bt)
+    if name == "SMACrossoverBrackets":
+        return backtest.SMACrossoverBrackets(bt)
+    return getattr(backtest, name).signals(bt)
+
+def engines(data):
+    cases = [("SMACrossoverSignals", ("vectorized", "compiled")), ("SMACrossoverBrackets", ("compiled",)),
+        ("RSISpec", ("vectorized", "compiled")), ("SMACrossoverSpec", ("compiled",))]
+    for name, fast in cases:
+        for long_max, short_max in ((1, 1), (1, 0), (0, 1)):
+            reference = Backtest(data, backtest.Signals, CAPITAL, long_max, short_max)
+            reference.signals = _signals(name, reference)
+            reference.run()
+            for engine in fast:
+                bt = Backtest(data, backtest.Signals, CAPITAL, long_max, short_max)
+                getattr(bt, "run_" + engine)(_signals(name, bt))
+                yield "{} {} long_max={} short_max={}".format(name, engine, long_max, short_max), \
+                    same(reference, bt)
+
+def streaming(data, chunksize=700):
+    for strategy in (backtest.SMACrossover, backtest.RSI, backtest.RSISpec):
+        reference = Backtest(data, strategy, CAPITAL)
+        reference.run()
+        n = len(data["Close"])
+        chunks = ({column: values[start:start + chunksize] for column, values in data.items()}
+            for start in range(0, n, chunksize))
+        bt = StreamBacktest(chunks, strategy, CAPITAL)
+        bt.run()
+        yield "stream {}".format(strategy.__name__), same(reference, bt)
+
+def snapshots(data):
+    for strategy, options in ((backtest.SMACrossover, {}), (backtest.RSI, {}),
+            (backtest.SMACrossover, {"intrabar": True, "oco": "worst"})):
+        reference = Backtest(data, strategy, CAPITAL, **options)
+        reference.run()
+        for cut in (0, 1, len(data["Close"]) // 2):
+            bt = Backtest(data, strategy, CAPITAL, **options)
+            bt.precompute(strategy)
+            bt.allocate()
+            for _ in range(cut):
+                bt.next()
+            restored = Backtest.restore(bt.snapshot(), data)
+            restored.run()
+            bt.run()
+            yield "snapshot {} {} at {}".format(strategy.__name__, options, cut), \
+                same(reference, restored) and same(reference, bt)
+
+def batches(data):
+    strategies = [backtest.SMACrossover, backtest.RSI, backtest.SMACrossover]
+    batch = Batch(data, strategies, CAPITAL)
+    batch.run()
+    for strategy, bt in zip(strategies, batch.accounts.values()):
+        reference = Backtest(data, strategy, CAPITAL)
+        reference.run()
+        yield "batch {}".format(strategy.__name__), same(reference, bt)
+
+def portfolios(data):
+    other = synthetic(len(data["Close"]), 1)
+    other["Date"] = data["Date"]
+    for strategy in (backtest.SMACrossover, backtest.RSI):
+        reference = Backtest(data, strategy, CAPITAL)
+        reference.run()
+        portfolio = Portfolio({"A": data}, strategy, CAPITAL, per_asset=True)
+        portfolio.run()
+        yield "portfolio {}".format(strategy.__name__), reference.equity == portfolio.equity and \
+            reference.stats() == portfolio.stats()
+
+        portfolio = Portfolio({"A": data, "B": other}, strategy, CAPITAL, per_asset=True)
+        portfolio.run()
+        stats, assets = portfolio.stats(), portfolio.asset_stats()
+        yield "portfolio {} two symbols".format(strategy.__name__), \
+            stats["# Positions"] == assets["# Positions"].sum() and stats["Geometric Return [%]"] is not None
+
+def walk_forwards(data, train=1000, test=500):
+    n = len(data["Close"])
+    for step in (test, test // 2, 2*test):
+        _, equity = walk_forward(backtest.SMACrossover, data, {"sma_short": [5, 10]}, train, test, step,
+            workers=1)
+        ranges = windows(n, train, test, step)
+        stops = [start for _, _, start, _ in ranges[1:]] + [n]
+        bars = sum(min(stop, next_start) - start for (_, _, start, stop), next_start in zip(ranges, stops))
+        yield "walk-forward step={}".format(step), len(equity) == bars and equity.index.is_unique and \
+            equity.index.is_monotonic_increasing
+
+CHECKS = (engines, streaming, snapshots, batches, portfolios, walk_forwards)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the engines against each other.")
+    parser.add_argument("--bars", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    data = synthetic(args.bars, args.seed)
+    failed = 0
+    for check in CHECKS:
+        try:
+            for name, ok in check(data):
+                print("{} {}".format("ok  " if ok else "FAIL", name))
+                failed += not ok
+        except Exception as error: # The rest of this check is skipped
+            print("FAIL {}: {!r}".format(check.__name__, error))
+            failed += 1
+    print("{} failed".format(failed))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+import numpy as np
+
+from fills import LONG_BUY, LONG_SELL, SHORT_SELL, SHORT_BUY, STOP_SELL, STOP_BUY
+
+# =============================================================================
+# Compiled Engine
+#
+# The bar loop for the Signals strategy compiled with Numba: the built-in
+# orders (market, limit, stop and OCO pairs) and the pending book are kept in
+# arrays, and each step mirrors Order.add()/execute(), OrderBook and
+# Backtest.next() operation for operation, so the floating point results are
+# identical to Backtest.run(). Without Numba the same functions run as plain
+# Python. Event logging is not available here.
+#
+# Pending orders are scanned in the order they were queued. Orders whose limit
+# has not been reached fail execute() without side effects, so this executes
+# the same orders in the same order as the OrderBook heaps.
+
+try:
+    from numba import njit
+    COMPILED = True
+except ImportError:
+    COMPILED = False
+
+    def njit(*args, **kwargs): # Run uncompiled
+        if args and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+# State slots
+BALANCE, HELD, OWED, EQUITY, PEAK, COMMISSION = range(6) # float64
+LONGS, SHORTS, ENTERED, DURATION, FILLS, QUEUED, FIRST, INDEX, RUINED = range(9) # int64
+
+@njit(cache=True)
+def _execute(code, size, limit, commission, price, bar, state, counts, fills):
+    balance = state[BALANCE]
+    if code == LONG_BUY or code == SHORT_SELL:
+        if size * price > balance:
+            return False
+        amount = commission * size * price
+        if size * price > balance - amount:
+            return False
+        if (code == LONG_BUY and price > limit) or (code == SHORT_SELL and price < limit):
+            return False
+        counts[ENTERED] += 1
+    else:
+        if (code == LONG_SELL or code == SHORT_BUY) and size <= 0:
+            return False
+        if code == LONG_SELL or code == STOP_SELL:
+            if size > state[HELD]:
+                return False
+        elif size > state[OWED]:
+            return False
+        amount = commission * size * price
+        if amount > balance + size * price:
+            return False
+        if (code == LONG_SELL and price < limit) or (code == SHORT_BUY and price > limit) or \
+            (code == STOP_SELL and price > limit) or (code == STOP_BUY and price < limit):
+            return False
+        if code == LONG_SELL or code == STOP_SELL:
+            counts[LONGS] -= 1
+        else:
+            counts[SHORTS] -= 1
+
+    k = counts[FILLS]
+    fills[k, 0] = bar
+    fills[k, 1] = code
+    fills[k, 2] = size
+    fills[k, 3] = price
+    fills[k, 4] = balance
+    fills[k, 5] = state[EQUITY]
+    fills[k, 6] = amount
+    counts[FILLS] = k + 1
+
+    if code == LONG_BUY:
+        state[HELD] += size
+        balance -= size * price
+    elif code == SHORT_SELL:
+        state[OWED] += size
+        balance += size * price
+    elif code == LONG_SELL or code == STOP_SELL:
+        state[HELD] -= size
+        balance += size * price
+    else:
+        state[OWED] -= size
+        balance -= size * price
+    balance -= amount
+    state[BALANCE] = balance
+    state[COMMISSION] += amount
+    return True
+
+@njit(cache=True)
+def _valid(code, size, state, counts, long_max, short_max):
+    if size <= 0:
+        return False
+    if code == LONG_BUY:
+        return counts[LONGS] < long_max
+    if code == SHORT_SELL:
+        return counts[SHORTS] < short_max
+    if code == LONG_SELL or code == STOP_SELL:
+        return size <= state[HELD]
+    return size <= state[OWED]
+
+# Order.add(): returns whether the order was accepted
+@njit(cache=True)
+def _add(code, size, limit, commission, price, bar, state, counts, fills, book, legs,
+    long_max, short_max):
+    if not _valid(code, size, state, counts, long_max, short_max):
+        return False
+    if code == LONG_BUY:
+        counts[LONGS] += 1
+    elif code == SHORT_SELL:
+        counts[SHORTS] += 1
+    if not _execute(code, size, limit, commission, price, bar, state, counts, fills):
+        _queue(book, legs, counts, code, size, limit, commission, -1, 0.0, 0.0, 0.0)
+    return True
+
+# Append a pending order, with a second OCO leg unless code2 is -1
+@njit(cache=True)
+def _queue(book, legs, counts, code, size, limit, commission, code2, size2, limit2, commission2):
+    q = counts[QUEUED]
+    book[q, 0] = code
+    book[q, 1] = size
+    book[q, 2] = limit
+    book[q, 3] = commission
+    book[q, 4] = code2
+    book[q, 5] = size2
+    book[q, 6] = limit2
+    book[q, 7] = commission2
+    legs[q] = 1 if code2 < 0 else 2
+    counts[QUEUED] = q + 1
+
+@njit(cache=True)
+def _bracket(take, stop, size, take_profit, stop_loss, commission, price, bar, state, counts, fills,
+    book, legs, long_max, short_max):
+    if take == LONG_SELL:
+        take_limit = price + take_profit
+        stop_limit = price - stop_loss
+    else:
+        take_limit = price - take_profit
+        stop_limit = price + stop_loss
+    if take_profit == take_profit and stop_loss == stop_loss:
+        if _valid(take, size, state, counts, long_max, short_max) and \
+            _valid(stop, size, state, counts, long_max, short_max):
+            _queue(book, legs, counts, take, size, take_limit, commission, stop, size, stop_limit, commission)
+    elif take_profit == take_profit:
+        _add(take, size, take_limit, commission, price, bar, state, counts, fills, book, legs,
+            long_max, short_max)
+    elif stop_loss == stop_loss:
+        _add(stop, size, stop_limit, commission, price, bar, state, counts, fills, book, legs,
+            long_max, short_max)
+
+@njit(cache=True)
+def run_signals(close, entries, exits, short_entries, short_exits, size, allocation, take_profit,
+    stop_loss, commission, capital, long_max, short_max, offset, state, counts, fills, book, legs,
+    equity_curve, cash_curve, position_curve):
+    n = close.shape[0]
+    nan = np.nan
+    state[BALANCE] = capital
+    state[EQUITY] = capital
+    state[PEAK] = capital
+    for i in range(n):
+        price = close[i]
+        bar = offset + i
+
+        # Pending orders, in queue order
+        first = counts[FIRST]
+        while first < counts[QUEUED] and legs[first] == 0:
+            first += 1
+        counts[FIRST] = first
+        for q in range(first, counts[QUEUED]):
+            if legs[q] == 0:
+                continue
+            if _execute(np.int64(book[q, 0]), book[q, 1], book[q, 2], book[q, 3], price, bar,
+                state, counts, fills):
+                legs[q] = 0
+            elif legs[q] == 2 and _execute(np.int64(book[q, 4]), book[q, 5], book[q, 6], book[q, 7],
+                price, bar, state, counts, fills):
+                legs[q] = 0
+
+        # Signals
+        if exits[i]:
+            _add(LONG_SELL, state[HELD], nan, commission, price, bar, state, counts, fills, book, legs,
+                long_max, short_max)
+        if short_exits[i]:
+            _add(SHORT_BUY, state[OWED], nan, commission, price, bar, state, counts, fills, book, legs,
+                long_max, short_max)
+        quantity = size[i]
+        if entries[i]:
+            if allocation == allocation:
+                quantity = np.floor(allocation*state[BALANCE]/price)
+            if _add(LONG_BUY, quantity, nan, commission, price, bar, state, counts, fills, book, legs,
+                long_max, short_max):
+                _bracket(LONG_SELL, STOP_SELL, state[HELD], take_profit[i], stop_loss[i], commission,
+                    price, bar, state, counts, fills, book, legs, long_max, short_max)
+        if short_entries[i]:
+            if allocation == allocation:
+                quantity = np.floor(allocation*state[BALANCE]/price)
+            if _add(SHORT_SELL, quantity, nan, commission, price, bar, state, counts, fills, book, legs,
+                long_max, short_max):
+                _bracket(SHORT_BUY, STOP_BUY, state[OWED], take_profit[i], stop_loss[i], commission,
+                    price, bar, state, counts, fills, book, legs, long_max, short_max)
+
+        equity = state[BALANCE] + (state[HELD] * price) - (state[OWED] * price)
+        state[EQUITY] = equity
+        equity_curve[i] = equity
+        cash_curve[i] = state[BALANCE]
+        position_curve[i] = state[HELD] - state[OWED]
+        if equity <= 0:
+            counts[INDEX] = i
+            counts[RUINED] = 1
+            return
+
+        if equity > state[PEAK]:
+            state[PEAK] = equity
+        if counts[LONGS] > 0 or counts[SHORTS] > 0:
+            counts[DURATION] += 1
+
+    # Liquidate at the final bar
+    i = n - 1
+    price = close[i]
+    _execute(LONG_SELL, state[HELD], nan, 0.0, price, offset + i, state, counts, fills)
+    _execute(SHORT_BUY, state[OWED], nan, 0.0, price, offset + i, state, counts, fills)
+    equity = state[BALANCE] + (state[HELD] * price) - (state[OWED] * price)
+    state[EQUITY] = equity
+    equity_curve[i] = equity
+    cash_curve[i] = state[BALANCE]
+    position_curve[i] = state[HELD] - state[OWED]
+    counts[INDEX] = i
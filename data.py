@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+# =============================================================================
+# Data Loading
+#
+# CSV price files are parsed once and stored as one .npy file per column in a
+# .cache directory beside the CSV, keyed by the file's path, modification time
+# and size. Later loads memory-map those files read-only, so repeated backtests
+# and worker processes share the same pages instead of re-parsing text. The
+# cache is written chunk by chunk, so files larger than memory can be cached
+# and then streamed with csv_chunks()/cache_chunks().
+
+CACHE_DIR = ".cache"
+CHUNK = 1000000 # Rows per chunk when reading incrementally
+PRICES = ("Open", "High", "Low", "Close", "Adj Close", "Volume") # Stored as float64
+
+def cache_path(path):
+    path = os.path.abspath(path)
+    status = os.stat(path)
+    key = "{}:{}:{}".format(path, status.st_mtime_ns, status.st_size)
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(os.path.dirname(path), CACHE_DIR,
+        "{}.{}".format(os.path.basename(path), digest))
+
+def _column(values, column):
+    if column in PRICES:
+        return values.to_numpy(dtype=np.float64)
+    if values.dtype.kind in "biuf":
+        return values.to_numpy()
+    return values.astype(str).to_numpy(dtype=str)
+
+def _write(path, directory):
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+
+    # First pass: row count and a dtype wide enough for every chunk
+    rows = 0
+    dtypes = {}
+    for frame in pd.read_csv(path, chunksize=CHUNK):
+        rows += len(frame)
+        for column in frame.columns:
+            dtype = _column(frame[column], column).dtype
+            dtypes[column] = np.result_type(dtypes.get(column, dtype), dtype)
+
+    # Build in a temporary directory and rename, so readers never see a partial cache
+    temp = tempfile.mkdtemp(dir=parent)
+    try:
+        os.chmod(temp, 0o755)
+        files = {column: np.lib.format.open_memmap(os.path.join(temp, "{}.npy".format(i)),
+            mode="w+", dtype=dtype, shape=(rows,)) for i, (column, dtype) in enumerate(dtypes.items())}
+        start = 0
+        for frame in pd.read_csv(path, chunksize=CHUNK):
+            for column, file in files.items():
+                file[start:start + len(frame)] = _column(frame[column], column)
+            start += len(frame)
+        for file in files.values():
+            file.flush()
+        del files
+        with open(os.path.join(temp, "columns.json"), "w") as file:
+            json.dump(list(dtypes), file)
+        os.rename(temp, directory)
+    except OSError:
+        shutil.rmtree(temp, ignore_errors=True)
+        if not os.path.isdir(directory): # Lost a race with another process otherwise
+            raise
+
+def _read(directory):
+    with open(os.path.join(directory, "columns.json")) as file:
+        names = json.load(file)
+    return {name: np.load(os.path.join(directory, "{}.npy".format(i)), mmap_mode="r")
+        for i, name in enumerate(names)}
+
+# Columns of a CSV file as (memory-mapped) arrays, by column name
+def load(path, cache=True):
+    if not cache:
+        frame = pd.read_csv(path)
+        return {column: frame[column].to_numpy() for column in frame.columns}
+
+    directory = cache_path(path)
+    if not os.path.isdir(directory):
+        try:
+            _write(path, directory)
+        except OSError: # No cache beside a read-only dataset, parse it every time
+            return load(path, cache=False)
+        _prune(directory)
+    return _read(directory)
+
+# Chunks of a CSV file as dicts of column arrays, parsed incrementally
+def csv_chunks(path, chunksize=CHUNK):
+    for frame in pd.read_csv(path, chunksize=chunksize):
+        yield {column: _column(frame[column], column) for column in frame.columns}
+
+# Chunks of the binary cache of a CSV file, copied out of the memory map in turn
+def cache_chunks(path, chunksize=CHUNK):
+    columns = load(path)
+    rows = len(next(iter(columns.values())))
+    for start in range(0, rows, chunksize):
+        yield {column: np.array(values[start:start + chunksize]) for column, values in columns.items()}
+
+# Remove caches of earlier versions of the same file
+def _prune(directory):
+    parent, name = os.path.split(directory)
+    prefix = name.rsplit(".", 1)[0] + "."
+    for entry in os.listdir(parent):
+        if entry != name and entry.startswith(prefix) and len(entry) == len(name):
+            shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
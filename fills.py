@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# Fill History
+#
+# Fills are kept in a growable NumPy structured array rather than as formatted
+# strings. Balance and equity are recorded as they stood before the fill, as in
+# the old history strings, which format_fill() still produces.
+
+LONG_BUY, LONG_SELL, SHORT_SELL, SHORT_BUY, STOP_SELL, STOP_BUY = range(6)
+NAMES = ("LONG BUY", "LONG SELL", "SHORT SELL", "SHORT BUY", "STOP SELL", "STOP BUY")
+
+FILL = np.dtype([
+    ("index", np.int64), # Bar
+    ("type", np.int8), # LONG_BUY, ...
+    ("quantity", np.float64),
+    ("price", np.float64),
+    ("balance", np.float64),
+    ("equity", np.float64),
+    ("commission", np.float64),
+    ("ints", np.uint8), # Bits for quantity/balance/equity passed as int, for formatting
+])
+
+class Fills:
+    def __init__(self, capacity=256):
+        self.data = np.zeros(capacity, dtype=FILL)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, key):
+        return self.records[key]
+
+    def __iter__(self):
+        return iter(self.records)
+
+    @property
+    def records(self): # View of the filled rows
+        return self.data[:self.count]
+
+    def _reserve(self, count):
+        if count > self.data.shape[0]:
+            data = np.zeros(max(count, 2*self.data.shape[0]), dtype=FILL)
+            data[:self.count] = self.data[:self.count]
+            self.data = data
+
+    def append(self, index, type, quantity, price, balance, equity, commission):
+        if self.count == self.data.shape[0]:
+            self._reserve(self.count + 1)
+        ints = (isinstance(quantity, int)) | (isinstance(balance, int) << 1) | \
+            (isinstance(equity, int) << 2)
+        self.data[self.count] = (index, type, quantity, price, balance, equity, commission, ints)
+        self.count += 1
+
+    # Append columns of fills at once
+    def extend(self, index, type, quantity, price, balance, equity, commission):
+        count = len(index)
+        self._reserve(self.count + count)
+        rows = self.data[self.count:self.count + count]
+        rows["index"] = index
+        rows["type"] = type
+        rows["quantity"] = quantity
+        rows["price"] = price
+        rows["balance"] = balance
+        rows["equity"] = equity
+        rows["commission"] = commission
+        rows["ints"] = 0
+        self.count += count
+
+    def strings(self):
+        return [format_fill(record) for record in self.records]
+
+    def frame(self):
+        frame = pd.DataFrame(self.records).drop(columns="ints")
+        frame["type"] = pd.Categorical.from_codes(frame["type"], NAMES)
+        return frame
+
+# The history string of a fill, e.g. "LONG BUY: Q: 10, C: 101.5, B: 10000, E: 10000.0"
+def format_fill(record):
+    ints = int(record["ints"])
+    quantity, balance, equity = (record[field].item() for field in ("quantity", "balance", "equity"))
+    if ints & 1:
+        quantity = int(quantity)
+    if ints & 2:
+        balance = int(balance)
+    if ints & 4:
+        equity = int(equity)
+    return "{}: Q: {}, C: {}, B: {}, E: {}".format(NAMES[record["type"]], quantity,
+        record["price"].item(), balance, equity)
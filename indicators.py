@@ -0,0 +1,303 @@
+import numpy as np
+
+import sys
+import math
+from collections import deque
+
+# =============================================================================
+# Precomputed Indicators
+#
+# Each function evaluates an indicator once over the whole series and returns an
+# array aligned to the bars, where out[i] is the value a strategy sees at bar i:
+# talib run over the trailing window close[i-window:i] (bar i itself excluded).
+# Bars without a full window are NaN.
+#
+# talib's running sums depend on where the window starts, so the window is
+# replayed with the same sequence of floating point operations, vectorised
+# across every bar. Values match the per-bar talib calls exactly for the
+# windows the strategies use (ATR smoothing past period+1 bars can differ from
+# talib in the last bit).
+
+def _segments(x, window):
+    # seg(k)[s] == x[s+k] for every window start s
+    m = x.shape[0] - window
+    return lambda k: x[k:k+m]
+
+def _aligned(values, n, window):
+    out = np.full(n, np.nan)
+    if values is not None:
+        out[window:] = values
+    return out
+
+def sma(close, period, window=None, shift=0):
+    # talib.SMA(close[i-window:i], period)[-1-shift]
+    window = period if window is None else window
+    n = close.shape[0]
+    last = window - 1 - shift # Position of the output within the window
+    if n <= window or last < period - 1:
+        return _aligned(None, n, window)
+
+    seg = _segments(close, window)
+    total = seg(0).copy()
+    for k in range(1, period):
+        total = total + seg(k)
+    for k in range(period, last + 1):
+        total = (total - seg(k - period)) + seg(k)
+
+    return _aligned(total / period, n, window)
+
+def rsi(close, period=14, window=None):
+    # talib.RSI(close[i-window:i], period)[-1]
+    window = period + 1 if window is None else window
+    n = close.shape[0]
+    if n <= window or window < period + 1:
+        return _aligned(None, n, window)
+
+    seg = _segments(close, window)
+    gain = np.zeros(n - window)
+    loss = np.zeros(n - window)
+    for k in range(1, window):
+        diff = seg(k) - seg(k - 1)
+        if k > period: # Wilder smoothing after the initial average
+            gain = gain * (period - 1)
+            loss = loss * (period - 1)
+        gain = gain + np.where(diff < 0, 0.0, diff)
+        loss = loss - np.where(diff < 0, diff, 0.0)
+        if k >= period: # talib scales by the reciprocal here rather than dividing
+            gain = gain * (1.0 / period)
+            loss = loss * (1.0 / period)
+
+    total = gain + loss
+    zero = (total > -0.00000001) & (total < 0.00000001)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = np.where(zero, 0.0, 100.0 * (gain / total))
+    return _aligned(values, n, window)
+
+def atr(high, low, close, period=14, window=None):
+    # talib.ATR(high[i-window:i], low[...], close[...], period)[-1]
+    window = period + 1 if window is None else window
+    n = close.shape[0]
+    if n <= window or window < period + 1:
+        return _aligned(None, n, window)
+
+    # True range of bar j against close j-1 (tr[0] is unused)
+    tr = np.empty(n)
+    tr[0] = np.nan
+    tr[1:] = np.maximum(np.maximum(high[1:] - low[1:], np.abs(close[:-1] - high[1:])),
+        np.abs(low[1:] - close[:-1]))
+
+    seg = _segments(tr, window)
+    total = seg(1).copy()
+    for k in range(2, period + 1):
+        total = total + seg(k)
+    value = total / period
+    for k in range(period + 1, window):
+        value = (value * (period - 1) + seg(k)) / period
+
+    return _aligned(value, n, window)
+
+# -----------------------------------------------------------------------------
+
+# Bars before the current one an indicator reads
+def lookback(name, *params):
+    if name == "SMA":
+        period, window = params[0], (params[1] if len(params) > 1 else None)
+        return period if window is None else window
+    period = params[0] if len(params) > 0 else 14
+    window = params[1] if len(params) > 1 else None
+    return period + 1 if window is None else window
+
+# Name: (function, input columns)
+INDICATORS = {
+    "SMA": (sma, ("Close",)),
+    "RSI": (rsi, ("Close",)),
+    "ATR": (atr, ("High", "Low", "Close")),
+}
+
+# =============================================================================
+# Incremental Indicators
+#
+# Stateful indicators updated one bar at a time in constant time, for feeds that
+# cannot be precomputed (streaming, paper trading). update() takes the newest
+# bar and returns the value including it (NaN while warming up); .value holds
+# the latest value and .previous the one before.
+#
+# By default they follow talib over the full history: SMA and EMA exactly, RSI
+# and ATR with Wilder smoothing. rolling=True instead averages only the last
+# period changes, which is what the windowed RSI/ATR strategy functions see
+# (talib over period+1 bars), up to rounding.
+
+class Incremental:
+    def __init__(self):
+        self.value = math.nan
+        self.previous = math.nan
+
+    def _set(self, value):
+        self.previous = self.value
+        self.value = value
+        return value
+
+class IncrementalSMA(Incremental):
+    def __init__(self, period):
+        super().__init__()
+        self.period = period
+        self.values = deque()
+        self.total = 0.0
+
+    def update(self, close):
+        self.values.append(close)
+        self.total += close
+        if len(self.values) < self.period:
+            return self._set(math.nan)
+        value = self.total / self.period
+        self.total -= self.values.popleft()
+        return self._set(value)
+
+class IncrementalEMA(Incremental):
+    def __init__(self, period):
+        super().__init__()
+        self.period = period
+        self.k = 2.0 / (period + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def update(self, close):
+        self.count += 1
+        if self.count < self.period: # Seeded with the SMA of the first period bars
+            self.total += close
+            return self._set(math.nan)
+        if self.count == self.period:
+            self.total += close
+            return self._set(self.total / self.period)
+        return self._set(((close - self.value) * self.k) + self.value)
+
+def _rsi(gain, loss):
+    total = gain + loss
+    if -0.00000001 < total < 0.00000001:
+        return 0.0
+    return 100.0 * (gain / total)
+
+class IncrementalRSI(Incremental):
+    def __init__(self, period=14, rolling=False):
+        super().__init__()
+        self.period = period
+        self.rolling = rolling
+        self.last = None # Previous close
+        self.count = 0 # Changes seen
+        self.gain = 0.0
+        self.loss = 0.0
+        self.changes = deque() # (gain, loss) of the last period changes, when rolling
+
+    def update(self, close):
+        last, self.last = self.last, close
+        if last is None:
+            return self._set(math.nan)
+        diff = close - last
+        gain, loss = (0.0, -diff) if diff < 0 else (diff, 0.0)
+        self.count += 1
+        period = self.period
+
+        if self.rolling:
+            self.changes.append((gain, loss))
+            self.gain += gain
+            self.loss += loss
+            if self.count > period:
+                old_gain, old_loss = self.changes.popleft()
+                self.gain -= old_gain
+                self.loss -= old_loss
+            if self.count < period:
+                return self._set(math.nan)
+            return self._set(_rsi(self.gain / period, self.loss / period))
+
+        if self.count > period: # Wilder smoothing
+            self.gain *= (period - 1)
+            self.loss *= (period - 1)
+        self.gain += gain
+        self.loss += loss
+        if self.count < period:
+            return self._set(math.nan)
+        self.gain *= (1.0 / period)
+        self.loss *= (1.0 / period)
+        return self._set(_rsi(self.gain, self.loss))
+
+class IncrementalATR(Incremental):
+    def __init__(self, period=14, rolling=False):
+        super().__init__()
+        self.period = period
+        self.rolling = rolling
+        self.last = None # Previous close
+        self.count = 0 # True ranges seen
+        self.total = 0.0
+        self.ranges = deque() # Last period true ranges, when rolling
+
+    def update(self, high, low, close):
+        last, self.last = self.last, close
+        if last is None:
+            return self._set(math.nan)
+        tr = max(high - low, abs(last - high), abs(low - last))
+        self.count += 1
+        period = self.period
+
+        if self.rolling:
+            self.ranges.append(tr)
+            self.total += tr
+            if self.count > period:
+                self.total -= self.ranges.popleft()
+            if self.count < period:
+                return self._set(math.nan)
+            return self._set(self.total / period)
+
+        if self.count < period:
+            self.total += tr
+            return self._set(math.nan)
+        if self.count == period:
+            self.total += tr
+            return self._set(self.total / period)
+        return self._set((self.value * (period - 1) + tr) / period)
+
+# Name: (class, input columns)
+INCREMENTAL = {
+    "SMA": (IncrementalSMA, ("Close",)),
+    "EMA": (IncrementalEMA, ("Close",)),
+    "RSI": (IncrementalRSI, ("Close",)),
+    "ATR": (IncrementalATR, ("High", "Low", "Close")),
+}
+
+# -----------------------------------------------------------------------------
+
+# Compare the incremental indicators with talib on a CSV file, both over the
+# full history and against the windowed values the strategies read
+def verify(path, period=14):
+    import talib
+    import pandas as pd
+
+    data = pd.read_csv(path)
+    high, low, close = (data[column].to_numpy(dtype=np.float64) for column in ("High", "Low", "Close"))
+
+    def replay(indicator, *columns):
+        return np.array([indicator.update(*bar) for bar in zip(*columns)])
+
+    def difference(values, expected):
+        both = ~np.isnan(expected)
+        if not np.array_equal(np.isnan(values), np.isnan(expected)):
+            return math.inf
+        return float(np.max(np.abs(values[both] - expected[both]), initial=0))
+
+    checks = {
+        "SMA": difference(replay(IncrementalSMA(period), close), talib.SMA(close, period)),
+        "EMA": difference(replay(IncrementalEMA(period), close), talib.EMA(close, period)),
+        "RSI": difference(replay(IncrementalRSI(period), close), talib.RSI(close, period)),
+        "ATR": difference(replay(IncrementalATR(period), high, low, close),
+            talib.ATR(high, low, close, period)),
+        # Windowed values at bar i cover bars before i, i.e. the update of bar i-1
+        "RSI (rolling)": difference(replay(IncrementalRSI(period, True), close)[:-1],
+            rsi(close, period)[1:]),
+        "ATR (rolling)": difference(replay(IncrementalATR(period, True), high, low, close)[:-1],
+            atr(high, low, close, period)[1:]),
+    }
+    for name, value in checks.items():
+        print("{}: max difference {:.3g}".format(name, value))
+    return checks
+
+if __name__ == "__main__":
+    verify(sys.argv[1] if len(sys.argv) > 1 else "datasets/GOOG.csv")
@@ -0,0 +1,114 @@
+import pandas as pd
+
+from collections import deque
+
+from fills import LONG_BUY, LONG_SELL, SHORT_SELL, SHORT_BUY, STOP_SELL, STOP_BUY
+
+# =============================================================================
+# Position Ledger
+#
+# Open positions are kept as lots per side. Exits close the oldest lots first
+# ("fifo"), or with "average" every entry is merged into one lot at the average
+# cost. Each fill only touches the lots it closes, so updates are constant time
+# (amortised), and running totals give realized and unrealized P&L without
+# scanning the fill history.
+#
+# A trade is one lot from entry until it is fully closed. Its P&L is net of the
+# entry commission and its share of each exit's commission; it counts as a win
+# when that P&L is positive. Commissions are realized when paid.
+
+OPENS = {LONG_BUY: 0, SHORT_SELL: 1} # Fill type: side (0 long, 1 short)
+CLOSES = {LONG_SELL: 0, STOP_SELL: 0, SHORT_BUY: 1, STOP_BUY: 1}
+SIDES = ("Long", "Short")
+COLUMNS = ("Side", "Entry Bar", "Exit Bar", "Duration [t]", "Quantity", "Entry Price", "Exit Price",
+    "Commission [$]", "P&L [$]", "Return [%]")
+
+# Lot fields, kept in a list for cheap updates
+QUANTITY, REMAINING, PRICE, BAR, COMMISSION, EXIT_VALUE, PNL = range(7)
+
+class Ledger:
+    def __init__(self, method="fifo"):
+        if method not in ("fifo", "average"):
+            raise ValueError("Unknown lot method {!r}, expected 'fifo' or 'average'".format(method))
+        self.method = method
+        self.lots = (deque(), deque()) # Open lots per side, oldest first
+        self.quantity = [0, 0] # Open quantity per side
+        self.cost = [0.0, 0.0] # Entry value of the open quantity per side
+        self.realized = 0.0
+        self.wins = 0
+        self.closed = [] # Finished trades as tuples of COLUMNS
+
+    # Record a fill of the given type (fills.LONG_BUY, ...) at bar
+    def fill(self, type, quantity, price, commission, bar):
+        side = OPENS.get(type)
+        if side is not None:
+            self.open(side, quantity, price, commission, bar)
+        else:
+            self.close(CLOSES[type], quantity, price, commission, bar)
+
+    def open(self, side, quantity, price, commission, bar):
+        lots = self.lots[side]
+        self.quantity[side] += quantity
+        self.cost[side] += quantity * price
+        self.realized -= commission
+        if self.method == "average" and lots:
+            lot = lots[0]
+            lot[PRICE] = (lot[REMAINING] * lot[PRICE] + quantity * price)/(lot[REMAINING] + quantity)
+            lot[QUANTITY] += quantity
+            lot[REMAINING] += quantity
+            lot[COMMISSION] += commission
+            lot[PNL] -= commission
+            return
+        lots.append([quantity, quantity, price, bar, commission, 0.0, -commission])
+
+    def close(self, side, quantity, price, commission, bar):
+        lots = self.lots[side]
+        sign = 1 if side == 0 else -1
+        share = commission/quantity if quantity else 0.0 # Exit commission per unit
+        while quantity > 0 and lots:
+            lot = lots[0]
+            take = min(quantity, lot[REMAINING])
+            pnl = sign * take * (price - lot[PRICE]) - share * take
+            lot[REMAINING] -= take
+            lot[EXIT_VALUE] += take * price
+            lot[COMMISSION] += share * take
+            lot[PNL] += pnl
+            self.realized += pnl
+            self.quantity[side] -= take
+            self.cost[side] -= take * lot[PRICE]
+            quantity -= take
+            if lot[REMAINING] <= 0:
+                lots.popleft()
+                self._finish(side, lot, bar)
+        if not lots: # Clear rounding left in the running totals
+            self.quantity[side] = 0
+            self.cost[side] = 0.0
+
+    def _finish(self, side, lot, bar):
+        quantity = lot[QUANTITY]
+        exit_price = lot[EXIT_VALUE]/quantity
+        sign = 1 if side == 0 else -1
+        if lot[PNL] > 0:
+            self.wins += 1
+        self.closed.append((SIDES[side], lot[BAR], bar, bar - lot[BAR], quantity, lot[PRICE], exit_price,
+            lot[COMMISSION], lot[PNL], 100*sign*(exit_price/lot[PRICE] - 1)))
+
+    def unrealized(self, price):
+        return (self.quantity[0] * price - self.cost[0]) + (self.cost[1] - self.quantity[1] * price)
+
+    # Open lots as (side, entry bar, remaining quantity, entry price, unrealized P&L at price)
+    def open_lots(self, price):
+        return [(SIDES[side], lot[BAR], lot[REMAINING], lot[PRICE],
+            (1 if side == 0 else -1) * lot[REMAINING] * (price - lot[PRICE]))
+            for side in (0, 1) for lot in self.lots[side]]
+
+    def frame(self):
+        return pd.DataFrame(self.closed, columns=COLUMNS)
+
+    # Replay a fill history (Fills or its records) into the ledger
+    def replay(self, history):
+        records = history.records if hasattr(history, "records") else history
+        for record in records:
+            self.fill(int(record["type"]), record["quantity"].item(), record["price"].item(),
+                record["commission"].item(), int(record["index"]))
+        return self
@@ -0,0 +1,182 @@
+import numpy as np
+
+import json
+import asyncio
+import argparse
+from array import array
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+
+import backtest
+from stream import StreamBacktest
+from data import cache_chunks, csv_chunks
+
+# =============================================================================
+# Live / Paper Trading
+#
+# Bars arrive one at a time from an asyncio feed (a file replay or a socket of
+# JSON lines) and are applied to a LiveBacktest, a StreamBacktest whose chunks
+# are single bars: the strategy and the Order classes run exactly as in a
+# backtest, over a buffer of the trailing bars its indicators read. No bar is
+# treated as the final one until the feed ends, when positions are liquidated.
+#
+# The Runner reads the feed into a bounded queue and evaluates bars on a worker
+# thread, so a slow strategy never stalls ingestion; when the queue is full the
+# reader waits (and a socket feed stops being read), which is the backpressure.
+# Decision latency, from a bar's arrival to the end of its strategy call, is
+# recorded for every bar (with the time spent evaluating it, which excludes
+# waiting in the queue) and checked against an optional budget.
+
+class LiveBacktest(StreamBacktest):
+    def __init__(self, bar, strategy, capital, long_max=1, short_max=1, lookback=None, **options):
+        super().__init__([_chunk(bar)], strategy, capital, long_max, short_max, lookback, **options)
+        self.precompute(strategy)
+
+    def _load(self, source):
+        super()._load(source)
+        self.length = self.bars + 1 # More bars may always follow
+
+    # Append a bar to the buffer, keeping the lookback, and process it
+    def push(self, bar):
+        self.upcoming = _chunk(bar)
+        self._advance()
+        return self.next()
+
+def _chunk(bar):
+    return {column: np.array([value]) for column, value in bar.items()}
+
+class Runner:
+    def __init__(self, strategy, capital, queue_size=1024, budget=None, **options):
+        self.strategy = strategy
+        self.capital = capital
+        self.options = options
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.budget = budget # Seconds per decision, None for no budget
+        self.bt = None
+        self.latency = array("d") # Seconds from arrival to decision, per bar
+        self.evaluation = array("d") # Seconds in the strategy step alone, per bar
+        self.depth = 0 # Deepest the queue got
+        self.ruined = False
+
+    async def ingest(self, feed):
+        try:
+            async for bar in feed:
+                await self.queue.put((perf_counter(), bar)) # Waits while the queue is full
+                self.depth = max(self.depth, self.queue.qsize())
+        finally:
+            await self.queue.put(None)
+
+    def _process(self, bar):
+        start = perf_counter()
+        if self.bt is None:
+            self.bt = LiveBacktest(bar, self.strategy, self.capital, **self.options)
+            alive = self.bt.next()
+        else:
+            alive = self.bt.push(bar)
+        self.evaluation.append(perf_counter() - start)
+        return alive
+
+    async def evaluate(self):
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=1) as worker: # One at a time, in arrival order
+            while True:
+                item = await self.queue.get()
+                if item is None:
+                    break
+                arrived, bar = item
+                if self.ruined:
+                    continue # Keep draining so ingestion can finish
+                if await loop.run_in_executor(worker, self._process, bar) == False:
+                    self.ruined = True
+                self.latency.append(perf_counter() - arrived)
+        if self.bt is not None and not self.ruined:
+            self.bt.liquidate()
+
+    async def run(self, feed):
+        await asyncio.gather(self.ingest(feed), self.evaluate())
+        return self.bt
+
+    def stats(self):
+        latency = np.array(self.latency)
+        stats = {"Bars": len(latency), "Max Queue Depth": self.depth}
+        if len(latency):
+            evaluation = np.array(self.evaluation)
+            stats.update({"Latency Mean [ms]": 1e3*latency.mean(),
+                "Latency p50 [ms]": 1e3*np.percentile(latency, 50),
+                "Latency p99 [ms]": 1e3*np.percentile(latency, 99),
+                "Latency Max [ms]": 1e3*latency.max(),
+                "Evaluation Mean [ms]": 1e3*evaluation.mean(),
+                "Evaluation p99 [ms]": 1e3*np.percentile(evaluation, 99)})
+            if self.budget is not None:
+                stats["Over Budget"] = int(np.count_nonzero(latency > self.budget))
+        return {key: value if isinstance(value, int) else float(value) for key, value in stats.items()}
+
+# -----------------------------------------------------------------------------
+# Feeds, as async iterators of bar dicts
+
+def _bars(chunk):
+    columns = list(chunk)
+    for row in zip(*(chunk[column].tolist() for column in columns)):
+        yield dict(zip(columns, row))
+
+# Replay a CSV file, optionally pausing delay seconds between bars
+async def replay(path, delay=0.0, chunksize=10000, cache=True):
+    chunks = cache_chunks if cache else csv_chunks
+    for chunk in chunks(path, chunksize):
+        for bar in _bars(chunk):
+            yield bar
+            await asyncio.sleep(delay) # Also lets other tasks run between bars
+
+# Bars sent as JSON lines over a TCP connection
+async def socket_feed(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            yield json.loads(line)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+# Serve a CSV file as JSON lines to each client, a stand-in for a market feed
+async def serve(path, host="127.0.0.1", port=8765, delay=0.0):
+    async def send(reader, writer):
+        async for bar in replay(path, delay):
+            writer.write((json.dumps(bar) + "\n").encode())
+            await writer.drain() # Blocks while the client is not reading
+        writer.close()
+        await writer.wait_closed()
+    server = await asyncio.start_server(send, host, port)
+    async with server:
+        await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Paper trade a strategy on a live or replayed feed.")
+    parser.add_argument("mode", choices=("replay", "connect", "serve"))
+    parser.add_argument("source", nargs="?", help="CSV file (replay, serve)")
+    parser.add_argument("--strategy", default="SMACrossover")
+    parser.add_argument("--capital", type=float, default=10000)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds between replayed bars")
+    parser.add_argument("--queue", type=int, default=1024, help="Bars buffered before backpressure")
+    parser.add_argument("--budget", type=float, default=None, help="Latency budget in milliseconds")
+    args = parser.parse_args(argv)
+
+    if args.mode == "serve":
+        asyncio.run(serve(args.source, args.host, args.port, args.delay))
+        return
+
+    feed = replay(args.source, args.delay) if args.mode == "replay" else socket_feed(args.host, args.port)
+    runner = Runner(getattr(backtest, args.strategy), args.capital, args.queue,
+        None if args.budget is None else args.budget/1000)
+    bt = asyncio.run(runner.run(feed))
+    if bt is not None:
+        bt.report()
+    for key, value in runner.stats().items():
+        print("{}: {}".format(key, value if isinstance(value, int) else "{:.3f}".format(value)))
+
+if __name__ == "__main__":
+    main()
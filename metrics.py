@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+from ledger import Ledger
+
+# =============================================================================
+# Performance Metrics
+#
+# Array functions over the per-bar series a backtest records (equity, cash and
+# net position, see Backtest.series()) and its fill history. Returns are per
+# bar; annualised figures assume PERIODS bars a year.
+
+PERIODS = 252 # Trading days a year
+
+def returns(equity):
+    equity = np.asarray(equity, dtype=np.float64)
+    return equity[1:]/equity[:-1] - 1
+
+# Compound annual growth rate, as a fraction
+def cagr(equity, periods=PERIODS):
+    equity = np.asarray(equity, dtype=np.float64)
+    if equity.shape[0] < 2:
+        return None
+    return annualised(equity[0], equity[-1], equity.shape[0] - 1, periods)
+
+# Growth rate a year from start to end over the given number of bars
+def annualised(start, end, bars, periods=PERIODS):
+    if bars <= 0 or start <= 0 or end <= 0:
+        return None
+    return (end/start)**(periods/bars) - 1
+
+def sharpe(equity, periods=PERIODS, risk_free=0.0):
+    excess = returns(equity) - risk_free/periods
+    deviation = excess.std(ddof=1) if excess.shape[0] > 1 else 0
+    if not deviation > 0:
+        return None
+    return np.sqrt(periods)*excess.mean()/deviation
+
+# Sharpe with only the downside deviation (below risk_free) in the denominator
+def sortino(equity, periods=PERIODS, risk_free=0.0):
+    excess = returns(equity) - risk_free/periods
+    if excess.shape[0] == 0:
+        return None
+    downside = np.sqrt(np.mean(np.minimum(excess, 0)**2))
+    if not downside > 0:
+        return None
+    return np.sqrt(periods)*excess.mean()/downside
+
+# Fraction below the running peak at each bar
+def drawdown(equity):
+    equity = np.asarray(equity, dtype=np.float64)
+    return 1 - equity/np.maximum.accumulate(equity)
+
+# Deepest drawdown (fraction) and the longest time below a peak (bars)
+def max_drawdown(equity):
+    equity = np.asarray(equity, dtype=np.float64)
+    if equity.shape[0] == 0:
+        return 0.0, 0
+    peak = np.maximum.accumulate(equity)
+    # Bars since the last new peak, from the index of the latest peak at each bar
+    at_peak = equity >= peak
+    last_peak = np.maximum.accumulate(np.where(at_peak, np.arange(equity.shape[0]), 0))
+    return float((1 - equity/peak).max()), int((np.arange(equity.shape[0]) - last_peak).max())
+
+# Fraction of bars with a position open
+def exposure(position):
+    position = np.asarray(position)
+    if position.shape[0] == 0:
+        return 0.0
+    return np.count_nonzero(position)/position.shape[0]
+
+# Round trips from a fill history, matched by a FIFO (or "average" cost) ledger
+def trades(history, method="fifo"):
+    return Ledger(method).replay(history).frame()
+
+# Every metric of a backtest that has run, as a dict (None where undefined)
+def summary(bt, periods=PERIODS, risk_free=0.0):
+    series = bt.series()
+    equity = np.concatenate(([bt.capital], series["Equity"].to_numpy())) # From the starting capital
+    if hasattr(bt, "assets"): # Portfolio
+        table = pd.concat([asset.ledger.frame() for asset in bt.assets], ignore_index=True)
+    else:
+        table = bt.ledger.frame()
+    depth, duration = max_drawdown(equity)
+    growth = cagr(equity, periods)
+    ratio = sharpe(equity, periods, risk_free)
+    downside = sortino(equity, periods, risk_free)
+    won = table["P&L [$]"] > 0
+    return {
+        "Bars": len(series),
+        "Equity Final [$]": float(equity[-1]),
+        "Total Return [%]": float(100*(equity[-1]/equity[0] - 1)),
+        "CAGR [%]": None if growth is None else float(100*growth),
+        "Sharpe Ratio": None if ratio is None else float(ratio),
+        "Sortino Ratio": None if downside is None else float(downside),
+        "Max Drawdown [%]": 100*depth,
+        "Max Drawdown Duration [t]": duration,
+        "Exposure [%]": float(100*exposure(series["Position"].to_numpy())),
+        "# Trades": len(table),
+        "Win Rate [%]": float(100*won.mean()) if len(table) else None,
+        "Average Trade [$]": float(table["P&L [$]"].mean()) if len(table) else None,
+        "Average Duration [t]": float(table["Duration [t]"].mean()) if len(table) else None,
+        "Profit Factor": float(table["P&L [$]"][won].sum()/-table["P&L [$]"][~won].sum())
+            if len(table) and (~won).any() and table["P&L [$]"][~won].sum() < 0 else None,
+    }
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import backtest
+from backtest import Backtest
+from metrics import returns, summary
+from ledger import COLUMNS
+from sweep import _value
+
+# =============================================================================
+# Monte Carlo
+#
+# Resamples a finished backtest to show how much its figures owe to the order
+# and luck of what happened. "returns" redraws the per-bar returns of the
+# equity curve in blocks (a circular block bootstrap, which keeps short-range
+# dependence such as volatility clusters inside each block); "trades" redraws
+# the closed trades' P&L with replacement, or only shuffles their order with
+# replace=False.
+#
+# Each batch of paths is one 2-D array (paths x bars or trades) of equity
+# built with a cumulative product or sum along the rows, a path that reaches
+# zero staying there, and batches run across a process pool, returning only
+# the metrics of each path. Every batch has its own seed spawned from the one
+# given, so results do not depend on the number of workers. Confidence bands
+# are percentiles of the metrics across paths.
+
+METHODS = ("returns", "trades")
+METRICS = ("Equity Final [$]", "Max Drawdown [%]", "Win Rate [%]") # As named by metrics.summary
+LEVELS = (5, 50, 95) # Percentiles
+BATCH = 1000 # Paths per task
+
+# What a method resamples: per-bar returns or trade P&Ls
+def samples(bt, method="returns"):
+    if method == "returns":
+        equity = np.concatenate(([bt.capital], bt.series()["Equity"].to_numpy()))
+        return returns(equity[~np.isnan(equity)])
+    if method == "trades":
+        ledgers = [asset.ledger for asset in bt.assets] if hasattr(bt, "assets") else [bt.ledger]
+        pnl = COLUMNS.index("P&L [$]")
+        return np.array([trade[pnl] for ledger in ledgers for trade in ledger.closed], dtype=np.float64)
+    raise ValueError("Unknown method {!r}, expected one of {}".format(method, METHODS))
+
+# Resampled draws and equity paths (starting at capital), one row per path
+def paths(values, count, method, capital, block=20, replace=True, rng=None):
+    rng = np.random.default_rng(rng)
+    n = values.shape[0]
+    if method == "returns":
+        starts = rng.integers(0, n, (count, -(-n // block)))
+        index = ((starts[:, :, None] + np.arange(block)) % n).reshape(count, -1)[:, :n]
+        drawn = values[index]
+        equity = capital*np.cumprod(1 + drawn, axis=1)
+    else:
+        if replace:
+            index = rng.integers(0, n, (count, n))
+        else:
+            index = rng.permuted(np.tile(np.arange(n), (count, 1)), axis=1)
+        drawn = values[index]
+        equity = capital + np.cumsum(drawn, axis=1)
+    equity[np.logical_or.accumulate(equity <= 0, axis=1)] = 0.0 # Ruined paths stop, as run() does
+    return drawn, np.concatenate((np.full((count, 1), float(capital)), equity), axis=1)
+
+def path_metrics(drawn, equity, method):
+    peak = np.maximum.accumulate(equity, axis=1)
+    metrics = {"Equity Final [$]": equity[:, -1], "Max Drawdown [%]": 100*(1 - equity/peak).max(axis=1)}
+    if method == "trades":
+        metrics["Win Rate [%]"] = 100*(drawn > 0).mean(axis=1)
+    return metrics
+
+def _batch(task):
+    values, count, method, capital, block, replace, seed = task
+    return path_metrics(*paths(values, count, method, capital, block, replace, np.random.default_rng(seed)),
+        method)
+
+# Metrics of count resampled paths, one row per path
+def simulate(bt, count=10000, method="returns", block=20, replace=True, seed=0, workers=None, batch=BATCH):
+    values = samples(bt, method)
+    if values.shape[0] == 0:
+        raise ValueError("Nothing to resample: the backtest has no {}".format(method))
+    sizes = [min(batch, count - start) for start in range(0, count, batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(values, size, method, bt.capital, block, replace, seed) for size, seed in zip(sizes, seeds)]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) == 1:
+        results = [_batch(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            results = list(pool.map(_batch, tasks))
+    return pd.DataFrame({key: np.concatenate([result[key] for result in results]) for key in results[0]})
+
+# Percentiles of each metric across paths, beside the backtest's own figures
+def bands(results, levels=LEVELS, bt=None):
+    table = pd.DataFrame({"{}%".format(level): results.quantile(level/100) for level in levels})
+    if bt is not None:
+        actual = summary(bt)
+        table["Backtest"] = [actual[key] for key in table.index]
+    return table
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resample a backtest for confidence bands.")
+    parser.add_argument("dataset", help="CSV price file")
+    parser.add_argument("--strategy", default="SMACrossover")
+    parser.add_argument("--capital", type=float, default=10000)
+    parser.add_argument("--param", action="append", default=[], help="name=value, e.g. commission=0")
+    parser.add_argument("--method", choices=METHODS, default="returns")
+    parser.add_argument("--paths", type=int, default=10000)
+    parser.add_argument("--block", type=int, default=20, help="Bars per block (returns)")
+    parser.add_argument("--no-replace", action="store_true", help="Shuffle trades instead of drawing them")
+    parser.add_argument("--levels", nargs="+", type=float, default=list(LEVELS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    params = {}
+    for param in args.param:
+        name, value = param.split("=", 1)
+        params[name] = _value(value)
+    bt = Backtest(args.dataset, getattr(backtest, args.strategy), args.capital, params=params)
+    bt.run()
+
+    results = simulate(bt, args.paths, args.method, args.block, not args.no_replace, args.seed,
+        args.workers)
+    with pd.option_context("display.width", None, "display.float_format", "{:.2f}".format):
+        print(bands(results, args.levels, bt))
+
+if __name__ == "__main__":
+    main()
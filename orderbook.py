@@ -0,0 +1,80 @@
+import heapq
+
+# =============================================================================
+# Pending Order Book
+#
+# Resting orders are indexed by trigger price so that each bar only visits the
+# orders its price range can fill. Orders declare which way they trigger:
+# "below" orders (buy limits, sell stops) fill once the price is at or under
+# their limit, "above" orders (sell limits, buy stops) at or over it. Each side
+# is a heap with the most easily triggered order on top. OCO legs are indexed
+# separately and share their pair's entry, which is dropped lazily from the
+# other heap once either leg fills. Orders without a limit (e.g. market orders
+# waiting for balance) are retried every bar.
+#
+# Triggered orders are executed in the order they were queued, as a plain list
+# scan would, and go back in the book if execute() still declines them. A fill
+# function, if given, executes each triggered order instead (e.g. at a price
+# inside the bar).
+
+class OrderBook:
+    def __init__(self):
+        self.below = [] # (-limit, seq, leg)
+        self.above = [] # (limit, seq, leg)
+        self.market = {} # seq: order, retried every bar
+        self.live = {} # seq: order, every pending order
+        self.seq = 0
+
+    def __len__(self):
+        return len(self.live)
+
+    def __iter__(self): # Pending orders in queue order
+        return iter(list(self.live.values()))
+
+    def append(self, order):
+        seq = self.seq
+        self.seq += 1
+        self.live[seq] = order
+
+        legs = (order.order1, order.order2) if hasattr(order, "order1") else (order,)
+        # NaN limits never compare, so those orders are checked every bar like market orders
+        if any(leg.limit is None or leg.limit != leg.limit for leg in legs):
+            self.market[seq] = order
+            return
+        for n, leg in enumerate(legs):
+            self._push((leg.trigger, leg.limit, seq, n))
+
+    def _push(self, entry):
+        trigger, limit, seq, n = entry
+        if trigger == "below":
+            heapq.heappush(self.below, (-limit, seq, n))
+        else:
+            heapq.heappush(self.above, (limit, seq, n))
+
+    # Execute the orders triggered by a bar trading between low and high
+    def execute(self, low, high, fill=None):
+        if not self.live:
+            return 0
+
+        triggered = {seq: [] for seq in self.market}
+        below, above, live = self.below, self.above, self.live
+        while below and -below[0][0] >= low:
+            key, seq, n = heapq.heappop(below)
+            if seq in live:
+                triggered.setdefault(seq, []).append(("below", -key, seq, n))
+        while above and above[0][0] <= high:
+            key, seq, n = heapq.heappop(above)
+            if seq in live:
+                triggered.setdefault(seq, []).append(("above", key, seq, n))
+
+        filled = 0
+        for seq in sorted(triggered):
+            order = live[seq]
+            if (order.execute() if fill is None else fill(order)) == True:
+                del live[seq] # Entries left in the other heap are now stale
+                self.market.pop(seq, None)
+                filled += 1
+            else:
+                for entry in triggered[seq]:
+                    self._push(entry)
+        return filled
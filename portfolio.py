@@ -0,0 +1,274 @@
+import numpy as np
+import pandas as pd
+
+import os
+from logging import INFO, WARNING
+
+from backtest import Backtest, Bar, LONGSELL, SHORTBUY
+from orderbook import OrderBook
+from fills import Fills
+from ledger import Ledger
+from indicators import INDICATORS
+from data import load
+
+# =============================================================================
+# Portfolio Backtest
+#
+# Runs N instruments together on one bar clock. Datasets are aligned on the
+# dates they share and held as T x N price matrices; positions are per-symbol
+# arrays against a single cash balance, and equity is one dot product per bar.
+#
+# Each symbol is exposed as an Asset, which behaves like a single-instrument
+# Backtest for the Order classes and strategy functions (price(), balance,
+# quantity_held, trades, indicator(), ...), but reads and writes the shared
+# portfolio state. The strategy is either called once per bar with the
+# portfolio, or with per_asset=True, once per bar for every Asset, so the
+# existing strategies run across many symbols in one pass.
+
+class Asset:
+    def __init__(self, portfolio, name, column):
+        self.portfolio = portfolio
+        self.name = name
+        self.column = column # Column in the price matrices
+        self.columns = {name: values[:, column] for name, values in portfolio.prices.items()} # Views
+        self.indicators = {}
+        self.params = portfolio.params
+        self.trades = OrderBook()
+        self.history = Fills()
+        self.offset = 0
+        self.bar = Bar(self)
+
+        # Per-symbol statistics
+        self.entered_positions = 0
+        self.commission_total = 0
+        self.ledger = Ledger(portfolio.lots)
+
+    def price(self):
+        portfolio = self.portfolio
+        return portfolio.close[portfolio.index, self.column]
+
+    def indicator(self, name, *params):
+        key = (name, params)
+        values = self.indicators.get(key)
+        if values is None:
+            function, columns = INDICATORS[name]
+            inputs = [np.ascontiguousarray(self.columns[column]) for column in columns]
+            values = function(*inputs, *params)
+            self.indicators[key] = values
+        return values
+
+    def emit(self, level, event, **fields):
+        fields["symbol"] = self.name
+        self.portfolio.emit(level, event, **fields)
+
+    winning_positions = property(lambda self: self.ledger.wins)
+    closed_positions = property(lambda self: len(self.ledger.closed))
+
+    # Shared portfolio state
+    index = property(lambda self: self.portfolio.index)
+    length = property(lambda self: self.portfolio.length)
+    equity = property(lambda self: self.portfolio.equity)
+    log = property(lambda self: self.portfolio.log)
+    long_max = property(lambda self: self.portfolio.long_max)
+    short_max = property(lambda self: self.portfolio.short_max)
+    open = property(lambda self: self.columns["Open"])
+    high = property(lambda self: self.columns["High"])
+    low = property(lambda self: self.columns["Low"])
+    close = property(lambda self: self.columns["Close"])
+
+    @property
+    def balance(self):
+        return self.portfolio.balance
+
+    @balance.setter
+    def balance(self, value):
+        self.portfolio.balance = value
+
+    @property
+    def quantity_held(self):
+        return self.portfolio.held[self.column]
+
+    @quantity_held.setter
+    def quantity_held(self, value):
+        self.portfolio.held[self.column] = value
+
+    @property
+    def quantity_owed(self):
+        return self.portfolio.owed[self.column]
+
+    @quantity_owed.setter
+    def quantity_owed(self, value):
+        self.portfolio.owed[self.column] = value
+
+    @property
+    def long_count(self):
+        return self.portfolio.long_count[self.column]
+
+    @long_count.setter
+    def long_count(self, value):
+        self.portfolio.long_count[self.column] = value
+
+    @property
+    def short_count(self):
+        return self.portfolio.short_count[self.column]
+
+    @short_count.setter
+    def short_count(self, value):
+        self.portfolio.short_count[self.column] = value
+
+class Portfolio:
+    def __init__(self, datapaths, strategy, capital, long_max=1, short_max=1, params=None,
+        per_asset=False, log=None, log_level=INFO, lots="fifo"):
+        # Paths (named after the file) or a dict of name: path / column arrays
+        if not isinstance(datapaths, dict):
+            datapaths = {os.path.splitext(os.path.basename(path))[0]: path for path in datapaths}
+        sources = {name: load(source) if isinstance(source, str) else source
+            for name, source in datapaths.items()}
+        self.names = list(sources)
+
+        # Bars on dates every dataset has, in date order
+        dates = None
+        for source in sources.values():
+            dates = source["Date"] if dates is None else np.intersect1d(dates, source["Date"])
+        dates = np.unique(dates)
+        rows = [np.searchsorted(source["Date"], dates) for source in sources.values()]
+        self.dates = dates
+        self.length = dates.shape[0]
+        self.prices = {}
+        for column in ("Open", "High", "Low", "Close", "Volume"):
+            if all(column in source for source in sources.values()):
+                self.prices[column] = np.column_stack([np.asarray(source[column], dtype=np.float64)[row]
+                    for source, row in zip(sources.values(), rows)])
+        self.close = self.prices["Close"] # T x N
+
+        self.index = 0
+        self.offset = 0
+        self.origin = 0
+        self.capital = capital
+        self.strategy = strategy
+        self.params = {} if params is None else params
+        self.per_asset = per_asset
+        self.lots = lots
+        self.log = log
+        self.log_level = log_level
+
+        # Working, shared by every asset
+        n = len(self.names)
+        self.balance = capital
+        self.equity = capital
+        self.held = np.zeros(n)
+        self.owed = np.zeros(n)
+        self.long_max = long_max
+        self.short_max = short_max
+        self.long_count = np.zeros(n, dtype=np.int64)
+        self.short_count = np.zeros(n, dtype=np.int64)
+
+        # Statistics
+        self.equity_peak = capital
+        self.trade_duration = 0 # Bars each symbol spent in a position, summed
+        self.equity_curve = None # Per bar, allocated by run()
+        self.cash_curve = None
+        self.position_curve = None # T x N net positions
+
+        self.assets = [Asset(self, name, j) for j, name in enumerate(self.names)]
+        self.first_date = dates[0]
+        self.first_close = self.close[0]
+
+    def __getitem__(self, name):
+        return self.assets[self.names.index(name)]
+
+    def emit(self, level, event, **fields):
+        if level >= self.log_level:
+            self.log(level, event, fields)
+
+    def run(self):
+        for asset in self.assets:
+            if self.per_asset:
+                Backtest.precompute(asset, self.strategy)
+        self.equity_curve = np.full(self.length, np.nan)
+        self.cash_curve = np.full(self.length, np.nan)
+        self.position_curve = np.full(self.close.shape, np.nan)
+
+        while self.index < self.length:
+            if self.next() == False:
+                return
+        self.liquidate()
+
+    def record(self):
+        if self.equity_curve is not None:
+            self.equity_curve[self.index] = self.equity
+            self.cash_curve[self.index] = self.balance
+            self.position_curve[self.index] = self.held - self.owed
+
+    # Per-bar series of the bars run, by date; Position counts the symbols held
+    def series(self):
+        end = self.index + 1
+        return pd.DataFrame({"Equity": self.equity_curve[:end], "Cash": self.cash_curve[:end],
+            "Position": np.count_nonzero(self.position_curve[:end], axis=1)},
+            index=pd.Index(self.dates[:end], name="Date"))
+
+    def next(self):
+        prices = self.close[self.index]
+
+        # Execute queued trades whose limits the price has reached
+        for asset in self.assets:
+            if asset.trades.live:
+                price = prices[asset.column]
+                asset.trades.execute(price, price)
+
+        if self.per_asset:
+            for asset in self.assets:
+                self.strategy(asset)
+        else:
+            self.strategy(self)
+
+        self.equity = self.balance + prices @ (self.held - self.owed)
+        self.record()
+        if self.equity <= 0:
+            if self.log is not None:
+                self.emit(WARNING, "ruin")
+            return False
+
+        self.index += 1
+
+        # Statistics
+        if self.equity > self.equity_peak:
+            self.equity_peak = self.equity
+        self.trade_duration += np.count_nonzero((self.long_count > 0) | (self.short_count > 0))
+        return True
+
+    def liquidate(self):
+        self.index -= 1
+        for asset in self.assets:
+            LONGSELL(asset, asset.quantity_held, commission=0).execute()
+            SHORTBUY(asset, asset.quantity_owed, commission=0).execute()
+        self.equity = self.balance + self.close[self.index] @ (self.held - self.owed)
+        self.record()
+
+    # Aggregates over the assets, so report() reads like a single backtest
+    entered_positions = property(lambda self: sum(a.entered_positions for a in self.assets))
+    winning_positions = property(lambda self: sum(a.winning_positions for a in self.assets))
+    closed_positions = property(lambda self: sum(a.closed_positions for a in self.assets))
+    commission_total = property(lambda self: sum(a.commission_total for a in self.assets))
+
+    def price(self):
+        return self.close[self.index]
+
+    # Equal-weighted across the symbols
+    def buy_and_hold(self):
+        return float(np.mean(100*(self.price() - self.first_close)/self.first_close))
+
+    stats = Backtest.stats
+    report = Backtest.report
+
+    # Per-symbol statistics
+    def asset_stats(self):
+        return pd.DataFrame([{
+            "Symbol": asset.name,
+            "Held": asset.quantity_held,
+            "Owed": asset.quantity_owed,
+            "# Positions": asset.entered_positions,
+            "Win Rate [%]": 100*asset.winning_positions/asset.closed_positions if asset.closed_positions else None,
+            "Commissions [$]": float(asset.commission_total),
+            "Buy-and-hold Return [%]": float(100*(asset.price() - asset.close[0])/asset.close[0]),
+        } for asset in self.assets])
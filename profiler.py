@@ -0,0 +1,94 @@
+import json
+from array import array
+from time import perf_counter
+
+# =============================================================================
+# Profiling
+#
+# Backtest(..., profile=True) times the phases of run(): indicator precompute,
+# then per bar the incremental indicator feed, order matching, the strategy
+# call and the equity update, and the final liquidation. Order execute()
+# calls are timed per class (LONGBUY.execute, OCO.execute, ...) wherever they
+# happen, nested under the phase that made them, and the pending queue length
+# is kept for every bar.
+#
+# Timings are kept per call path (e.g. "run;orders;OCO.execute"), so
+# they export as JSON or as folded stacks for flamegraph.pl/speedscope. Without
+# a profiler the backtest only checks bt.profiler is None at each phase.
+#
+# The order classes are wrapped only while a profiled run is in progress, so
+# other backtests running in the same process at that time are timed too.
+
+class Profiler:
+    def __init__(self):
+        self.frames = [] # Open frames as [path, start, time in children]
+        self.calls = {} # By path
+        self.seconds = {} # Total, by path
+        self.own = {} # Excluding children, by path
+        self.queue = array("q") # Pending orders at the start of each bar
+
+    def enter(self, name):
+        path = self.frames[-1][0] + ";" + name if self.frames else name
+        self.frames.append([path, perf_counter(), 0.0])
+
+    def exit(self):
+        path, start, children = self.frames.pop()
+        elapsed = perf_counter() - start
+        self.calls[path] = self.calls.get(path, 0) + 1
+        self.seconds[path] = self.seconds.get(path, 0.0) + elapsed
+        self.own[path] = self.own.get(path, 0.0) + elapsed - children
+        if self.frames:
+            self.frames[-1][2] += elapsed
+
+    # Wrap the execute() of each order class until stop()
+    def start(self, classes):
+        self.wrapped = []
+        for cls in classes:
+            execute = cls.__dict__["execute"]
+            cls.execute = self._timed(cls.__name__ + ".execute", execute)
+            self.wrapped.append((cls, execute))
+        self.enter("run")
+
+    def stop(self):
+        while self.frames: # Close frames left open by an exception or an early return
+            self.exit()
+        for cls, execute in self.wrapped:
+            cls.execute = execute
+        self.wrapped = []
+
+    def _timed(self, name, execute):
+        def timed(order, *args):
+            self.enter(name)
+            try:
+                return execute(order, *args)
+            finally:
+                self.exit()
+        return timed
+
+    def stats(self):
+        queue = self.queue
+        return {
+            "phases": [{"path": path, "calls": self.calls[path], "seconds": self.seconds[path],
+                "self_seconds": self.own[path]} for path in sorted(self.calls)],
+            "queue": {"bars": len(queue), "mean": sum(queue)/len(queue) if queue else 0.0,
+                "max": max(queue, default=0)},
+        }
+
+    def to_json(self, path=None, queue=False):
+        stats = self.stats()
+        if queue:
+            stats["queue"]["per_bar"] = self.queue.tolist()
+        if path is None:
+            return json.dumps(stats, indent=1)
+        with open(path, "w") as file:
+            json.dump(stats, file, indent=1)
+
+    # Folded stacks, "run;orders 1234" with self time in microseconds
+    def folded(self, path=None):
+        lines = ["{} {}".format(stack, round(1e6*seconds)) for stack, seconds in sorted(self.own.items())
+            if round(1e6*seconds) > 0]
+        text = "\n".join(lines) + "\n"
+        if path is None:
+            return text
+        with open(path, "w") as file:
+            file.write(text)
@@ -0,0 +1,126 @@
+import os
+import zlib
+import pickle
+import importlib
+
+from fills import Fills
+
+# =============================================================================
+# Snapshots
+#
+# A backtest's state between two bars as compressed bytes: balances and
+# counters, the pending orders in queue order (OCO pairs with both legs), the
+# fill history, the ledger's open lots and closed trades, the per-bar series so
+# far, incremental indicators and signal arrays. Price data and precomputed
+# indicators are left out, so a snapshot stays small however long the series:
+# restoring loads the same data again (checked against the snapshot) and
+# recomputes indicators from it, then continues exactly as the original run
+# would have.
+#
+# Snapshots are pickles, so only restore ones you trust.
+
+VERSION = 1
+
+# Run state, set back on restore
+STATE = ("index", "offset", "origin", "first_date", "first_close", "quantity_held", "quantity_owed", "balance",
+    "pnl", "equity", "long_count", "short_count", "entered_positions", "equity_peak", "trade_duration",
+    "commission_total", "signals", "online", "ledger")
+# Constructor settings, which restore() and fork() can override
+SETTINGS = ("long_max", "short_max", "params", "intrabar", "oco")
+
+# A pending order without its backtest
+class _Order:
+    __slots__ = ("cls", "values")
+
+    def __init__(self, cls, values):
+        self.cls = cls
+        self.values = values
+
+def _encode(order):
+    values = dict(getattr(order, "__dict__", {}))
+    for cls in type(order).__mro__:
+        for name in getattr(cls, "__slots__", ()):
+            if name != "bt":
+                values[name] = getattr(order, name)
+    for name, value in values.items():
+        if hasattr(value, "bt"): # OCO legs
+            values[name] = _encode(value)
+    return _Order(type(order), values)
+
+def _decode(bt, encoded):
+    order = encoded.cls.__new__(encoded.cls)
+    order.bt = bt
+    for name, value in encoded.values.items():
+        setattr(order, name, _decode(bt, value) if isinstance(value, _Order) else value)
+    return order
+
+def _reference(strategy):
+    module = getattr(strategy, "__module__", None)
+    name = getattr(strategy, "__qualname__", "")
+    if module is None or "<" in name: # Lambdas and nested functions cannot be found again
+        return None
+    return "{}:{}".format(module, name)
+
+def dumps(bt):
+    state = {name: getattr(bt, name) for name in STATE}
+    state.update({name: getattr(bt, name) for name in SETTINGS})
+    end = bt.index
+    state.update(version=VERSION, capital=bt.capital, strategy=_reference(bt.strategy),
+        length=bt.length, last_close=float(bt.close[end-1]) if end > 0 else None,
+        history=bt.history.records, orders=[_encode(order) for order in bt.trades])
+    if bt.equity_curve is not None:
+        state["curves"] = (bt.equity_curve[:end], bt.cash_curve[:end], bt.position_curve[:end])
+    return zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+def loads(data):
+    state = pickle.loads(zlib.decompress(data))
+    if state.get("version") != VERSION:
+        raise ValueError("Unsupported snapshot version {!r}".format(state.get("version")))
+    return state
+
+# Write atomically, so a crash while saving leaves the previous snapshot intact
+def save(bt, path):
+    temp = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp, "wb") as file:
+        file.write(dumps(bt))
+    os.replace(temp, path)
+
+def read(source): # Snapshot bytes, or a path to them
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return loads(bytes(source))
+    with open(source, "rb") as file:
+        return loads(file.read())
+
+def strategy(state):
+    if state["strategy"] is None:
+        raise ValueError("The snapshot's strategy cannot be imported, pass it to restore()")
+    module, name = state["strategy"].split(":")
+    target = importlib.import_module(module)
+    for part in name.split("."):
+        target = getattr(target, part)
+    return target
+
+def settings(state):
+    values = {name: state[name] for name in SETTINGS}
+    values["lots"] = state["ledger"].method
+    return values
+
+# Set the run state of a freshly constructed backtest
+def apply(bt, state):
+    end = state["index"]
+    if bt.length != state["length"] or (end > 0 and float(bt.close[end-1]) != state["last_close"]):
+        raise ValueError("Data does not match the snapshot")
+    for name in STATE:
+        setattr(bt, name, state[name])
+
+    bt.history = Fills(max(256, len(state["history"])))
+    bt.history.data[:len(state["history"])] = state["history"]
+    bt.history.count = len(state["history"])
+    for order in state["orders"]:
+        bt.trades.append(_decode(bt, order))
+
+    if "curves" in state:
+        bt.allocate()
+        for curve, values in zip((bt.equity_curve, bt.cash_curve, bt.position_curve), state["curves"]):
+            curve[:end] = values
+    return bt
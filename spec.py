@@ -0,0 +1,175 @@
+import numpy as np
+
+import ast
+import operator
+
+from indicators import lookback
+
+# =============================================================================
+# Strategy Specs
+#
+# A strategy written as data: default parameters, named indicators, and
+# entry/exit rules and bracket sizing as expressions over them, e.g.
+#
+#   {"params": {"period": 14, "upper": 70},
+#    "indicators": {"rsi": ["RSI", "period"]},
+#    "exits": "rsi > upper", ...}
+#
+# compile_spec() evaluates every expression once over whole arrays and returns
+# the signals dict read by the Signals strategy, run_vectorized() and
+# run_compiled(), so the same spec runs on each engine and the bar loop only
+# indexes arrays. Parameters in bt.params override the spec's defaults, which
+# makes specs sweepable like any strategy (see backtest.Spec).
+#
+# Expressions may use numbers, parameters, indicators, the price columns
+# (Open, High, Low, Close, Volume), rules defined before them (in the order
+# of RULES), arithmetic, comparisons (NaN compares false), & | ~ and the
+# functions in FUNCTIONS. Keys:
+#
+#   entries, exits, short_entries, short_exits: rules placing market orders
+#   size or allocation: units per entry, or a fraction of the balance
+#   take_profit, stop_loss: bracket distances from the entry price
+#   commission: commission rate of every order
+#   warmup: bars at the start on which no rule fires
+#   last_bar: whether rules may fire on the final bar (default True)
+
+RULES = ("entries", "exits", "short_entries", "short_exits")
+VALUES = ("size", "allocation", "take_profit", "stop_loss", "commission")
+
+# Values of x n bars earlier, NaN before the start
+def _shift(x, n=1):
+    x = np.asarray(x, dtype=np.float64)
+    out = np.full(x.shape[0], np.nan)
+    if n < x.shape[0]:
+        out[n:] = x[:x.shape[0] - n]
+    return out
+
+def _cross_above(a, b):
+    return (_shift(a) <= _shift(b)) & (np.asarray(a) > np.asarray(b))
+
+def _cross_below(a, b):
+    return (_shift(a) >= _shift(b)) & (np.asarray(a) < np.asarray(b))
+
+FUNCTIONS = {"shift": _shift, "cross_above": _cross_above, "cross_below": _cross_below, "abs": np.abs,
+    "min": np.minimum, "max": np.maximum}
+
+OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow,
+    ast.BitAnd: np.logical_and, ast.BitOr: np.logical_or}
+COMPARISONS = {ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+    ast.Eq: operator.eq, ast.NotEq: operator.ne}
+
+def evaluate(expression, names):
+    if not isinstance(expression, str):
+        return expression # A number
+    return _node(ast.parse(expression, mode="eval").body, names, expression)
+
+def _node(node, names, expression):
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, bool)):
+        return node.value
+    if isinstance(node, ast.Name):
+        if node.id not in names:
+            raise ValueError("Unknown name {!r} in {!r}".format(node.id, expression))
+        return names[node.id]
+    if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+        return OPERATORS[type(node.op)](_node(node.left, names, expression),
+            _node(node.right, names, expression))
+    if isinstance(node, ast.UnaryOp):
+        value = _node(node.operand, names, expression)
+        if isinstance(node.op, ast.USub):
+            return -value
+        if isinstance(node.op, (ast.Invert, ast.Not)):
+            return np.logical_not(value)
+    if isinstance(node, ast.BoolOp):
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        value = _node(node.values[0], names, expression)
+        for operand in node.values[1:]:
+            value = combine(value, _node(operand, names, expression))
+        return value
+    if isinstance(node, ast.Compare) and all(type(op) in COMPARISONS for op in node.ops):
+        left = _node(node.left, names, expression)
+        value = True
+        for op, comparator in zip(node.ops, node.comparators): # a < b < c is a < b & b < c
+            right = _node(comparator, names, expression)
+            value = np.logical_and(value, COMPARISONS[type(op)](left, right))
+            left = right
+        return value
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS \
+        and not node.keywords:
+        return FUNCTIONS[node.func.id](*[_node(arg, names, expression) for arg in node.args])
+    raise ValueError("Unsupported expression {!r}".format(expression))
+
+def params(spec, bt):
+    values = dict(spec.get("params", {}))
+    values.update(bt.params)
+    return values
+
+# Indicators a spec reads as (name, *params) tuples, as strategies declare them
+def spec_indicators(spec, bt):
+    names = params(spec, bt)
+    return tuple((name, *[evaluate(param, names) for param in arguments])
+        for name, *arguments in spec.get("indicators", {}).values())
+
+# Bars before the current one a spec reads, for streaming
+def spec_lookback(spec, bt):
+    declared = [lookback(*indicator) for indicator in spec_indicators(spec, bt)]
+    return max(declared + [evaluate(spec.get("warmup", 0), params(spec, bt))])
+
+# Signal arrays for the bars of bt
+def compile_spec(spec, bt):
+    n = bt.close.shape[0]
+    names = params(spec, bt)
+    names.update(bt.columns)
+    for key, declared in zip(spec.get("indicators", {}), spec_indicators(spec, bt)):
+        names[key] = bt.indicator(*declared)
+
+    warmup = evaluate(spec.get("warmup", 0), names)
+    signals = {}
+    for rule in RULES:
+        if rule in spec:
+            values = np.array(np.broadcast_to(evaluate(spec[rule], names), (n,)), dtype=np.bool_)
+            values[:warmup] = False
+            if not spec.get("last_bar", True):
+                values[bt.length - 1:] = False # Empty while streaming, until the final chunk
+            signals[rule] = names[rule] = values
+    for key in VALUES:
+        if key in spec:
+            value = evaluate(spec[key], names)
+            signals[key] = float(value) if np.ndim(value) == 0 else np.asarray(value, dtype=np.float64)
+    return signals
+
+# -----------------------------------------------------------------------------
+
+# The built-in strategies as specs, placing the same orders as RSI and
+# SMACrossover (with one position per side)
+RSI_SPEC = {
+    "params": {"rsi_period": 14, "upper": 70, "lower": 30, "commission": 0.002},
+    "indicators": {"rsi": ["RSI", "rsi_period"]},
+    "exits": "rsi > upper",
+    "short_entries": "rsi > upper",
+    "short_exits": "rsi < lower",
+    "entries": "rsi < lower",
+    "size": 1,
+    "commission": "commission",
+    "warmup": "rsi_period + 1",
+}
+
+SMA_CROSSOVER_SPEC = {
+    "params": {"sma_short": 10, "sma_long": 20, "atr_mult": 1.5, "atr_period": 14, "commission": 0.002,
+        "allocation": 0.998},
+    "indicators": {
+        "short": ["SMA", "sma_short", "sma_long + 1"],
+        "short_prev": ["SMA", "sma_short", "sma_long + 1", 1],
+        "long": ["SMA", "sma_long", "sma_long + 1"],
+        "long_prev": ["SMA", "sma_long", "sma_long + 1", 1],
+        "atr": ["ATR", "atr_period"],
+    },
+    "entries": "(short_prev <= long_prev) & (short >= long)",
+    "short_entries": "(short_prev >= long) & (short <= long) & ~entries", # As SMACrossover compares them
+    "allocation": "allocation",
+    "take_profit": "atr_mult * atr",
+    "stop_loss": "atr_mult * atr",
+    "commission": "commission",
+    "warmup": "sma_long + 1",
+    "last_bar": False,
+}
@@ -0,0 +1,191 @@
+import numpy as np
+import pandas as pd
+
+import os
+import json
+import time
+import sqlite3
+
+from fills import FILL, NAMES
+from metrics import summary
+
+# =============================================================================
+# Result Store
+#
+# Persists runs in a directory: a SQLite database of each run's settings,
+# parameters and metrics, and the equity curves and fills as columnar .npy
+# files. Parameters and metrics are kept one row per name and value, indexed,
+# so queries such as the top Sharpe ratios among GOOG runs with commission
+# 0.002 only read the index and never the curves:
+#
+#   store.query("Sharpe Ratio", symbol="GOOG", commission=0.002)
+#
+# Runs are written in batches, one transaction and one curve file and fill
+# file per batch, with each run's rows located by offset. Workers only build
+# records (see record()), and the process collecting them writes, so a
+# parallel sweep never contends for the database (see sweep(store=...)).
+# Curves and fills are read back memory-mapped, one run at a time.
+
+DATABASE = "results.sqlite"
+BATCH = 256 # Runs per write
+RUNS = ("strategy", "dataset", "symbol", "capital", "long_max", "short_max") # Filterable run columns
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (id INTEGER PRIMARY KEY, created REAL);
+CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, batch INTEGER, strategy TEXT, dataset TEXT,
+    symbol TEXT, capital REAL, long_max INTEGER, short_max INTEGER, params TEXT,
+    curve_start INTEGER, curve_length INTEGER, fills_start INTEGER, fills_length INTEGER);
+CREATE TABLE IF NOT EXISTS params (run INTEGER, name TEXT, value REAL, text TEXT);
+CREATE TABLE IF NOT EXISTS metrics (run INTEGER, name TEXT, value REAL);
+CREATE INDEX IF NOT EXISTS runs_symbol ON runs (symbol, strategy);
+CREATE INDEX IF NOT EXISTS params_value ON params (name, value, run);
+CREATE INDEX IF NOT EXISTS params_text ON params (name, text, run);
+CREATE INDEX IF NOT EXISTS metrics_value ON metrics (name, value, run);
+CREATE INDEX IF NOT EXISTS metrics_run ON metrics (run);
+"""
+
+# A finished backtest as a record for Store.write(): settings, parameters
+# (with the strategy's declared defaults), every numeric metric of stats() and
+# metrics.summary(), equity curve and fills
+def record(bt, dataset=None, strategy=None, **fields):
+    stats = bt.stats()
+    if bt.equity_curve is not None:
+        stats.update(summary(bt))
+    values = {key: float(value) for key, value in stats.items()
+        if isinstance(value, (int, float, np.number)) and not isinstance(value, bool)}
+    params = dict(getattr(bt.strategy, "params", {}))
+    params.update(bt.params)
+    row = {"strategy": strategy or getattr(bt.strategy, "__name__", type(bt.strategy).__name__),
+        "dataset": dataset, "symbol": _symbol(dataset), "capital": float(bt.capital), "long_max": bt.long_max,
+        "short_max": bt.short_max, "params": params, "metrics": values,
+        "equity": np.zeros(0) if bt.equity_curve is None else bt.series()["Equity"].to_numpy(dtype=np.float64),
+        "fills": np.array(bt.history.records)}
+    row.update(fields)
+    return row
+
+def _symbol(dataset): # datasets/GOOG.csv -> GOOG
+    if not isinstance(dataset, str):
+        return None
+    return os.path.splitext(os.path.basename(dataset))[0]
+
+def _param(value): # (number, text) columns of a parameter value
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return float(value), None
+    return None, str(value)
+
+class Store:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(path, DATABASE), timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL") # Readers do not block the writer
+        self.connection.executescript(SCHEMA)
+        self.pending = []
+        self.batch = BATCH
+        self.maps = {} # Memory-mapped batch files, by name
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Queue records, writing every batch of them
+    def add(self, records):
+        self.pending.extend(records)
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.write(self.pending)
+            self.pending = []
+
+    # Write records in one transaction, with their curves and fills in one file each
+    def write(self, records):
+        records = list(records)
+        if not records:
+            return []
+        with self.connection:
+            batch = self.connection.execute("INSERT INTO batches (created) VALUES (?)", (time.time(),)).lastrowid
+            curves = [record["equity"] for record in records]
+            fills = [record["fills"] for record in records]
+            self._save(batch, "equity", np.concatenate(curves) if curves else np.zeros(0))
+            self._save(batch, "fills", np.concatenate(fills) if fills else np.zeros(0, dtype=FILL))
+            curve_starts = np.cumsum([0] + [len(curve) for curve in curves])
+            fill_starts = np.cumsum([0] + [len(rows) for rows in fills])
+
+            ids = []
+            for i, record in enumerate(records):
+                run = self.connection.execute("INSERT INTO runs (batch, strategy, dataset, symbol, capital, "
+                    "long_max, short_max, params, curve_start, curve_length, fills_start, fills_length) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (batch, record["strategy"], record["dataset"], record["symbol"], record["capital"],
+                    record["long_max"], record["short_max"], json.dumps(record["params"], default=str),
+                    int(curve_starts[i]), len(curves[i]), int(fill_starts[i]), len(fills[i]))).lastrowid
+                ids.append(run)
+                self.connection.executemany("INSERT INTO params (run, name, value, text) VALUES (?, ?, ?, ?)",
+                    [(run, name, *_param(value)) for name, value in record["params"].items()])
+                self.connection.executemany("INSERT INTO metrics (run, name, value) VALUES (?, ?, ?)",
+                    [(run, name, value) for name, value in record["metrics"].items()])
+        return ids
+
+    def _file(self, batch, kind):
+        return os.path.join(self.path, "{}-{}.npy".format(kind, batch))
+
+    def _save(self, batch, kind, values):
+        temp = self._file(batch, kind) + ".tmp"
+        with open(temp, "wb") as file:
+            np.save(file, values)
+        os.replace(temp, self._file(batch, kind))
+
+    def _slice(self, run, kind):
+        start, length, batch = self.connection.execute("SELECT {0}_start, {0}_length, batch FROM runs "
+            "WHERE id = ?".format(kind), (run,)).fetchone()
+        name = self._file(batch, "equity" if kind == "curve" else "fills")
+        values = self.maps.get(name)
+        if values is None:
+            values = self.maps[name] = np.load(name, mmap_mode="r")
+        return values[start:start + length]
+
+    # Equity after each bar of a run
+    def equity(self, run):
+        return np.array(self._slice(run, "curve"))
+
+    def fills(self, run): # As Fills.frame()
+        frame = pd.DataFrame(np.array(self._slice(run, "fills"))).drop(columns="ints")
+        frame["type"] = pd.Categorical.from_codes(frame["type"], NAMES)
+        return frame
+
+    def metrics(self, run):
+        return dict(self.connection.execute("SELECT name, value FROM metrics WHERE run = ?", (run,)))
+
+    # Runs ranked by a metric, filtered by run columns (strategy, symbol, ...)
+    # and parameters, e.g. query("Sharpe Ratio", symbol="GOOG", commission=0.002)
+    def query(self, metric, limit=10, ascending=False, metrics=(), **filters):
+        joins, joined = [], [] # Parameter joins and their values
+        where, values = ["m.name = ?"], [metric]
+        for n, (name, value) in enumerate(filters.items()):
+            if name in RUNS:
+                where.append("r.{} = ?".format(name))
+                values.append(value)
+                continue
+            number, text = _param(value)
+            joins.append("JOIN params p{0} ON p{0}.run = m.run AND p{0}.name = ? AND p{0}.{1} = ?".format(n,
+                "text" if number is None else "value"))
+            joined += [name, text if number is None else number]
+        sql = "SELECT r.id AS run, r.strategy, r.symbol, r.params, m.value FROM metrics m " \
+            "JOIN runs r ON r.id = m.run {} WHERE {} ORDER BY m.value {} LIMIT ?".format(" ".join(joins),
+            " AND ".join(where), "ASC" if ascending else "DESC")
+        frame = pd.read_sql_query(sql, self.connection, params=joined + values + [limit])
+        frame = frame.rename(columns={"value": metric})
+        for name in metrics: # Further metrics of the selected runs
+            frame[name] = [self.metrics(run).get(name) for run in frame["run"]]
+        return frame
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
@@ -0,0 +1,86 @@
+import numpy as np
+
+from backtest import Backtest
+from indicators import lookback as indicator_lookback
+from data import csv_chunks, cache_chunks
+
+# =============================================================================
+# Streaming Backtest
+#
+# Runs a strategy over a feed of chunks (dicts of column arrays, see
+# data.csv_chunks/cache_chunks) without holding the whole dataset. Only the
+# current chunk is kept, plus the trailing bars the strategy's indicators read,
+# so memory stays constant however long the feed is.
+#
+# Arrays, indicators and bt.index are relative to the current buffer; bt.offset
+# is the bar number of its first row. Indicators are recomputed per chunk over
+# the buffer, which gives the same values as over the full series since each
+# only reads its trailing window. One chunk is read ahead so that bt.length
+# only marks the final bar on the last chunk. Warm-up checks on bt.index (e.g.
+# bt.index < 15) hold as long as the lookback covers them. Higher timeframes
+# (see timeframe.py) are extended with each chunk rather than rebuilt.
+
+class StreamBacktest(Backtest):
+    def __init__(self, feed, strategy, capital, long_max=1, short_max=1, lookback=None, **options):
+        self.chunks = iter(feed)
+        self.upcoming = next(self.chunks) # Read ahead to know when the feed ends
+        super().__init__(self._next_chunk(), strategy, capital, long_max, short_max, **options)
+        self.lookback = self.required(strategy) if lookback is None else lookback
+
+    # Bars before the current one the strategy reads: its lookback attribute
+    # (an int or a function of the backtest), otherwise its widest indicator
+    def required(self, strategy):
+        declared = getattr(strategy, "lookback", None)
+        if declared is not None:
+            return declared(self) if callable(declared) else declared
+        declared = getattr(strategy, "indicators", ())
+        if callable(declared):
+            declared = declared(self)
+        return max([indicator_lookback(name, *params) for name, *params in declared], default=0)
+
+    def _next_chunk(self):
+        chunk = self.upcoming
+        self.upcoming = next(self.chunks, None)
+        return chunk
+
+    def _load(self, source):
+        super()._load(source)
+        self.bars = self.length # Rows in the buffer
+        if self.upcoming is not None:
+            self.length += 1 # More bars follow, so none here is the final bar
+
+    def _advance(self):
+        keep = min(max(self.lookback, 1), self.bars) # Incremental indicators read the last bar
+        start = self.bars - keep
+        chunk = self._next_chunk()
+        self._load({column: np.concatenate((values[start:], chunk[column]))
+            for column, values in self.source.items()})
+        self.offset += start
+        self.index -= start
+        for frame in self.timeframes.values(): # Aggregates carry on from the bars before
+            frame.extend(self.dates[keep:], {column: values[keep:] for column, values in self.columns.items()},
+                self.offset + keep, keep)
+        self.indicators = {}
+        self.precompute(self.strategy)
+
+    # Timeframes are built from the first bar on, so later chunks cannot start one
+    def timeframe(self, rule):
+        if rule not in self.timeframes and self.offset > 0:
+            raise ValueError("Declare timeframes in strategy.timeframes to use them when streaming")
+        return super().timeframe(rule)
+
+    def run(self):
+        self.precompute(self.strategy)
+
+        while True:
+            while self.index < self.bars:
+                if self.next() == False:
+                    return
+            if self.upcoming is None:
+                break
+            self._advance()
+        self.liquidate()
+
+def stream(path, strategy, capital, chunksize=100000, cache=True, **options):
+    chunks = cache_chunks if cache else csv_chunks
+    return StreamBacktest(chunks(path, chunksize), strategy, capital, **options)
@@ -0,0 +1,125 @@
+import pandas as pd
+
+import os
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import backtest
+from backtest import Backtest
+from data import load
+from store import Store, record
+
+# =============================================================================
+# Parameter Sweep
+#
+# Runs every combination of strategy, dataset, capital, long_max/short_max and
+# strategy parameters across a process pool. CSV datasets are converted to the
+# binary cache once in the parent and memory-mapped by each worker, so no worker
+# parses a CSV and all of them share the same pages. Datasets given as loaded
+# DataFrames are handed to the workers when they start instead.
+
+_DATA = {} # Datasets by name, per worker
+ENGINES = ("loop", "vectorized", "compiled")
+
+def _init(data):
+    global _DATA
+    _DATA = {name: load(source) if isinstance(source, str) else source
+        for name, source in data.items()}
+
+def _run(task):
+    dataset, strategy, capital, long_max, short_max, params, engine, keep = task
+    bt = Backtest(_DATA[dataset], strategy, capital, long_max, short_max, params=params)
+    if engine == "loop":
+        bt.run()
+    else: # Strategies with signal arrays, e.g. backtest.Spec
+        getattr(bt, "run_" + engine)(strategy.signals(bt))
+
+    row = {"Dataset": dataset, "Strategy": strategy.__name__, "Capital": capital,
+        "Long Max": long_max, "Short Max": short_max}
+    row.update(params)
+    row.update(bt.stats())
+    return (row, record(bt, dataset)) if keep else row
+
+# Every combination of the given parameter values, e.g.
+# grid(sma_short=[5, 10], atr_mult=[1, 1.5]) -> 4 parameter dicts
+def grid(**axes):
+    keys = list(axes)
+    return [dict(zip(keys, values)) for values in itertools.product(*axes.values())]
+
+# engine: "loop" for run(), or "vectorized"/"compiled" for strategies given as
+# signal arrays (see backtest.Spec). With a store (a Store or its directory)
+# every run is also saved there, written in batches as workers finish
+def sweep(strategies, datasets, capitals=(10000,), params=None, long_max=(1,), short_max=(1,),
+    workers=None, engine="loop", store=None):
+    if engine not in ENGINES:
+        raise ValueError("Unknown engine {!r}, expected one of {}".format(engine, ENGINES))
+    # Datasets by name: paths, or a dict of loaded DataFrames / column arrays
+    data = dict(datasets) if isinstance(datasets, dict) else {path: path for path in datasets}
+    for source in data.values():
+        if isinstance(source, str):
+            load(source) # Build the cache before the workers start
+    tasks = list(itertools.product(data, strategies, capitals, long_max, short_max,
+        grid(**params) if params else [{}], (engine,), (store is not None,)))
+
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(tasks) // (4*workers))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init, initargs=(data,)) as pool:
+        results = pool.map(_run, tasks, chunksize=chunksize)
+        if store is None:
+            rows = list(results)
+        else:
+            target = Store(store) if isinstance(store, str) else store
+            rows = []
+            for row, run in results:
+                rows.append(row)
+                target.add([run])
+            if target is store:
+                target.flush()
+            else:
+                target.close()
+    return pd.DataFrame(rows)
+
+# -----------------------------------------------------------------------------
+
+def _value(text):
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a grid of backtests in parallel.")
+    parser.add_argument("datasets", nargs="+", help="CSV price files")
+    parser.add_argument("--strategy", nargs="+", default=["SMACrossover"])
+    parser.add_argument("--capital", nargs="+", type=float, default=[10000])
+    parser.add_argument("--param", action="append", default=[],
+        help="name=v1,v2,... e.g. sma_short=5,10 or commission=0,0.002")
+    parser.add_argument("--long-max", nargs="+", type=int, default=[1])
+    parser.add_argument("--short-max", nargs="+", type=int, default=[1])
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--engine", choices=ENGINES, default="loop",
+        help="vectorized/compiled run spec strategies (e.g. SMACrossoverSpec) without the bar loop")
+    parser.add_argument("--output", help="Write results to this CSV instead of printing")
+    parser.add_argument("--store", help="Also save every run to this result store directory")
+    args = parser.parse_args(argv)
+
+    params = {}
+    for param in args.param:
+        name, values = param.split("=", 1)
+        params[name] = [_value(value) for value in values.split(",")]
+    strategies = [getattr(backtest, name) for name in args.strategy]
+
+    results = sweep(strategies, args.datasets, args.capital, params, args.long_max,
+        args.short_max, args.workers, args.engine, args.store)
+    if args.output:
+        results.to_csv(args.output, index=False)
+    else:
+        with pd.option_context("display.max_rows", None, "display.max_columns", None,
+            "display.width", None):
+            print(results)
+
+if __name__ == "__main__":
+    main()
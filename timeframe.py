@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+
+from indicators import INDICATORS, lookback
+
+# =============================================================================
+# Higher Timeframes
+#
+# Aggregates the base bars into higher-timeframe OHLCV bars: every rule bars
+# for an int rule, or calendar periods of the Date column for a pandas
+# frequency ("4h", "1D", "W", "MS", ...). The aggregates are built once, and
+# extended chunk by chunk when streaming, then read through arrays aligned to
+# the base bars, so a strategy's lookup at bt.index is a single index.
+#
+# At base bar i only the periods before the one bar i falls in are complete:
+# column(name)[i] is the last completed period's value and indicator(...)[i]
+# the indicator over completed periods, which like the base indicators
+# excludes the bar still forming. A period counts as complete once a bar of
+# the next one arrives.
+#
+# When streaming, each chunk appends its periods and the values of its bars
+# to the aligned arrays, reading only the periods their indicators need, and
+# periods older than the buffer's first bar minus the deepest indicator
+# lookback are dropped. An indicator first read after periods were dropped
+# must not need more of them than were kept: declare it in
+# strategy.timeframes (see Backtest.precompute).
+
+COLUMNS = ("Open", "High", "Low", "Close", "Volume")
+
+class Timeframe:
+    def __init__(self, rule):
+        self.rule = rule
+        self.keys = np.zeros(0, dtype=np.int64) # Per kept period, the last one still forming
+        self.columns = {} # Aggregated columns, one row per kept period
+        self.first = 0 # Number of the first kept period
+        self.period = np.zeros(0, dtype=np.int64) # Per base bar, the number of its period
+        self.aligned = {} # Arrays aligned to the base bars, by column or (name, params)
+        self.depth = 1 # Completed periods read before a bar's own, at most
+
+    def __len__(self): # Completed periods
+        return max(self.first + len(self.keys) - 1, 0)
+
+    # Period of each bar, as an int64 key that increases with time
+    def _keys(self, dates, offset):
+        n = len(dates)
+        if isinstance(self.rule, (int, np.integer)):
+            return (offset + np.arange(n)) // self.rule
+        index = pd.DatetimeIndex(pd.to_datetime(dates))
+        tick = isinstance(pd.tseries.frequencies.to_offset(self.rule), pd.offsets.Tick)
+        first = pd.Series(np.arange(n), index=index).resample(self.rule,
+            origin="epoch" if tick else "start_day").first().dropna() # Same bins for every chunk
+        starts = first.to_numpy().astype(np.int64)
+        return np.repeat(first.index.asi8, np.diff(np.append(starts, n)))
+
+    # Add bars (dates and price columns) numbered from offset, after keeping
+    # the last keep bars of the period and aligned arrays (the bars a stream
+    # buffer keeps)
+    def extend(self, dates, columns, offset=0, keep=0):
+        keys = self._keys(dates, offset)
+        n = len(keys)
+        kept = self.period[len(self.period) - keep:]
+        if n == 0:
+            self.period = kept
+            self.aligned = {key: values[len(values) - keep:] for key, values in self.aligned.items()}
+            return
+
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        ends = np.append(starts[1:], n) - 1
+        periods = {}
+        for column in COLUMNS:
+            if column in columns:
+                values = np.asarray(columns[column], dtype=np.float64)
+                if column == "Open":
+                    periods[column] = values[starts]
+                elif column == "High":
+                    periods[column] = np.maximum.reduceat(values, starts)
+                elif column == "Low":
+                    periods[column] = np.minimum.reduceat(values, starts)
+                elif column == "Close":
+                    periods[column] = values[ends]
+                else:
+                    periods[column] = np.add.reduceat(values, starts)
+        keys = keys[starts]
+
+        # The first period may continue the one still forming
+        base = self.first + len(self.keys)
+        if len(self.keys) > 0 and keys[0] == self.keys[-1]:
+            base -= 1
+            for column, values in self.columns.items():
+                new = periods[column]
+                if column == "High":
+                    values[-1] = max(values[-1], new[0])
+                elif column == "Low":
+                    values[-1] = min(values[-1], new[0])
+                elif column == "Close":
+                    values[-1] = new[0]
+                elif column == "Volume":
+                    values[-1] += new[0]
+            keys = keys[1:]
+            periods = {column: values[1:] for column, values in periods.items()}
+
+        self.keys = np.concatenate((self.keys, keys))
+        self.columns = {column: np.concatenate((self.columns.get(column, np.zeros(0)), values))
+            for column, values in periods.items()}
+        period = base + np.searchsorted(starts, np.arange(n), side="right") - 1
+        self.period = np.concatenate((kept, period))
+        for key, values in self.aligned.items():
+            self.aligned[key] = np.concatenate((values[len(values) - keep:], self._values(key, period)))
+
+        # Drop the periods no bar from the buffer's first on reads
+        drop = self.period[0] - self.depth - self.first
+        if drop > 0:
+            self.keys = self.keys[drop:]
+            self.columns = {column: values[drop:] for column, values in self.columns.items()}
+            self.first += drop
+
+    # Values at bars in the given periods, reading only the kept periods they need
+    def _values(self, key, period):
+        if isinstance(key, str): # The last completed period's value
+            return np.concatenate(([np.nan], self.columns[key]))[period - self.first]
+        name, params = key
+        function, columns = INDICATORS[name]
+        # out[p] only reads periods before p, so the forming period is never seen
+        start = max(period[0] - lookback(name, *params) - self.first, 0)
+        values = function(*[self.columns[column][start:] for column in columns], *params)
+        return values[period - self.first - start]
+
+    # Value of the last completed period at each base bar, NaN before the first
+    def column(self, name):
+        values = self.aligned.get(name)
+        if values is None:
+            values = self.aligned[name] = self._values(name, self.period)
+        return values
+
+    # Indicator over the completed periods at each base bar (see indicators.py)
+    def indicator(self, name, *params):
+        key = (name, params)
+        values = self.aligned.get(key)
+        if values is None:
+            depth = lookback(name, *params)
+            if self.first > 0 and self.period[0] - depth < self.first:
+                raise ValueError("{}{} on timeframe {!r} reads periods no longer kept, declare it in "
+                    "strategy.timeframes".format(name, params, self.rule))
+            self.depth = max(self.depth, depth)
+            values = self.aligned[key] = self._values(key, self.period)
+        return values
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import backtest
+from backtest import Backtest, _ffill
+from data import load
+from sweep import grid, _value
+
+# =============================================================================
+# Walk-Forward Optimisation
+#
+# Splits a dataset into train/test windows, rolling (fixed-length train) or
+# anchored (train always starts at the first bar). Every parameter set is run on
+# each train slice, the best by a stats() metric is run on the following test
+# slice, and the out-of-sample equity curves are chained into one.
+#
+# Indicator arrays for every parameter set are computed once over the full
+# series in the parent and sliced per window; each bar of an indicator only
+# reads its trailing window, so a slice equals a recomputation except that the
+# first bars of a window also see the data before it. Windows run across a
+# process pool, train slices first and then the test slices.
+
+_DATA = {} # Column arrays, per worker
+_INDICATORS = {} # Full-series indicator arrays by (name, params), per worker
+
+def _init(source, indicators):
+    global _DATA, _INDICATORS
+    _DATA = load(source) if isinstance(source, str) else source
+    _INDICATORS = indicators
+
+def _run(task):
+    strategy, capital, start, stop, params = task
+    bt = Backtest({column: values[start:stop] for column, values in _DATA.items()},
+        strategy, capital, params=params)
+    bt.offset = bt.origin = start
+    bt.indicators = {key: values[start:stop] for key, values in _INDICATORS.items()}
+    bt.run()
+    return bt.stats(), _ffill(bt.equity_curve, bt.capital) # Flat after ruin
+
+# Train and test bar ranges as (train_start, train_stop, test_start, test_stop).
+# Windows advance by step bars (default: test), the last test slice may be short
+def windows(length, train, test, step=None, anchored=False):
+    step = step or test
+    result = []
+    start = 0
+    while start + train < length:
+        test_start = start + train
+        result.append((0 if anchored else start, test_start, test_start, min(test_start + test, length)))
+        start += step
+    return result
+
+def walk_forward(strategy, dataset, params, train, test, step=None, anchored=False,
+    capital=10000, metric="Equity Final [$]", workers=None):
+    source = load(dataset) if isinstance(dataset, str) else dataset
+    length = len(source["Close"])
+    candidates = grid(**params) if params else [{}]
+    ranges = windows(length, train, test, step, anchored)
+    if not ranges:
+        raise ValueError("Dataset of {} bars is too short for a {} bar train window".format(length, train))
+
+    # Every indicator the parameter sets declare, over the full series
+    indicators = {}
+    for candidate in candidates:
+        bt = Backtest(source, strategy, capital, params=candidate)
+        bt.indicators = indicators
+        bt.precompute(strategy)
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init,
+        initargs=(dataset if isinstance(dataset, str) else source, indicators)) as pool:
+        tasks = [(strategy, capital, train_start, train_stop, candidate)
+            for train_start, train_stop, _, _ in ranges for candidate in candidates]
+        scores = [stats[metric] for stats, _ in pool.map(_run, tasks,
+            chunksize=max(1, len(tasks) // (4*workers)))]
+        scores = np.array([-np.inf if score is None else score for score in scores]).reshape(len(ranges), -1)
+        best = [candidates[i] for i in np.argmax(scores, axis=1)]
+
+        tests = [(strategy, capital, test_start, test_stop, candidate)
+            for (_, _, test_start, test_stop), candidate in zip(ranges, best)]
+        results = list(pool.map(_run, tests))
+
+    # Chain the test curves by return, as if each window reinvested the last one's equity.
+    # With step < test the windows overlap and each is cut at the next one's start;
+    # with step > test the bars between windows are left out
+    rows = []
+    curves = []
+    index = []
+    scale = 1.0
+    dates = source["Date"]
+    stops = [test_start for _, _, test_start, _ in ranges[1:]] + [length]
+    for (train_start, train_stop, test_start, test_stop), stop, candidate, score, (stats, curve) in \
+        zip(ranges, stops, best, scores.max(axis=1), results):
+        row = {"Train Start": dates[train_start], "Train End": dates[train_stop - 1],
+            "Test Start": dates[test_start], "Test End": dates[test_stop - 1]}
+        row.update(candidate)
+        row["Train " + metric] = score
+        row.update({"Test " + key: value for key, value in stats.items() if key not in ("Start", "End")})
+        rows.append(row)
+        curve = curve[:min(test_stop, stop) - test_start]
+        curves.append(curve*scale)
+        index.append(dates[test_start:test_start + len(curve)])
+        scale *= curve[-1]/capital
+
+    equity = pd.Series(np.concatenate(curves), index=np.concatenate(index), name="Equity")
+    return pd.DataFrame(rows), equity
+
+# -----------------------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Walk-forward optimise a strategy.")
+    parser.add_argument("dataset", help="CSV price file")
+    parser.add_argument("--strategy", default="SMACrossover")
+    parser.add_argument("--param", action="append", default=[],
+        help="name=v1,v2,... e.g. sma_short=5,10")
+    parser.add_argument("--train", type=int, required=True, help="Bars per train window")
+    parser.add_argument("--test", type=int, required=True, help="Bars per test window")
+    parser.add_argument("--step", type=int, default=None)
+    parser.add_argument("--anchored", action="store_true")
+    parser.add_argument("--capital", type=float, default=10000)
+    parser.add_argument("--metric", default="Equity Final [$]")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", help="Write the out-of-sample equity curve to this CSV")
+    args = parser.parse_args(argv)
+
+    params = {}
+    for param in args.param:
+        name, values = param.split("=", 1)
+        params[name] = [_value(value) for value in values.split(",")]
+
+    results, equity = walk_forward(getattr(backtest, args.strategy), args.dataset, params,
+        args.train, args.test, args.step, args.anchored, args.capital, args.metric, args.workers)
+    with pd.option_context("display.max_rows", None, "display.max_columns", None,
+        "display.width", None):
+        print(results)
+    if args.output:
+        equity.to_csv(args.output)
+    else:
+        print("Out-of-sample Return [%]: {:.2f}".format(100*(equity.iloc[-1] - args.capital)/args.capital))
+
+if __name__ == "__main__":
+    main()